@@ -1,15 +1,22 @@
 import asyncio
+from datetime import datetime
 from aiogram import Bot, Dispatcher, types
 from aiogram.contrib.fsm_storage.memory import MemoryStorage
 from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters.state import State, StatesGroup
 from aiogram.utils import executor
 from aiogram.dispatcher.middlewares import BaseMiddleware
-from aiogram.utils.exceptions import BotBlocked, ChatNotFound, UserDeactivated
+from aiogram.utils.exceptions import BotBlocked, ChatNotFound, UserDeactivated, MessageNotModified
 
-from config import BOT_TOKEN, ADMIN_IDS, MESSAGES
+from config import BOT_TOKEN, ADMIN_IDS, MESSAGES, CACHE_PERSIST_FILE, ANALYTICS_DAYS, BOT_MODE
 from db import db
 from sheets import sheets_manager
+from sheets_writer import sheets_writer
+from sheets_warmer import cache_warmer
+from sheets_changes import change_detector
+from utils.rate_limiter import sheets_scheduler
+from utils.cache import cache
+from webhook import run_webhook
 from keyboards import (
     get_contact_keyboard, 
     get_main_menu_keyboard,
@@ -18,7 +25,9 @@ from keyboards import (
     get_tasks_keyboard, 
     get_admin_keyboard,
     get_task_status_keyboard,
-    get_add_note_keyboard
+    get_add_note_keyboard,
+    get_tasks_page_keyboard,
+    CURSOR_TIME_FORMAT
 )
 from utils.logger import logger
 
@@ -184,6 +193,47 @@ async def select_project(message: types.Message, state: FSMContext):
     )
     await TaskSelectionStates.selecting_project.set()
 
+# Значки статусов задач в списках
+STATUS_EMOJI = {
+    'pending': '⏳',
+    'approved': '✅',
+    'rejected': '❌',
+    'completed': '🎉',
+    'cancelled': '🚫'
+}
+
+
+def format_user_tasks(page: dict) -> str:
+    """Текст страницы задач пользователя"""
+    response = "<b>📝 Ваши задачи:</b>\n\n"
+    for task in page['items']:
+        emoji = STATUS_EMOJI.get(task['status'], '❓')
+        response += (
+            f"{emoji} <b>{task['project_name']}</b>\n"
+            f"📝 {task['task_name']}\n"
+            f"Статус: {task['status']}\n"
+            f"Создано: {task['created_at'].strftime('%d.%m.%Y %H:%M')}\n\n"
+        )
+    return response
+
+
+def format_all_tasks(page: dict, status: str = None) -> str:
+    """Текст страницы всех задач для админа"""
+    title = f"📑 Все задачи ({status})" if status else "📑 Все задачи"
+    if not page['items']:
+        return f"<b>{title}:</b>\n\nЗадач нет."
+    response = f"<b>{title}:</b>\n\n"
+    for task in page['items']:
+        emoji = STATUS_EMOJI.get(task['status'], '❓')
+        response += (
+            f"{emoji} <b>{task['name']}</b> ({task['phone']})\n"
+            f"📋 {task['project_name']}\n"
+            f"📝 {task['task_name'][:50]}...\n"
+            f"Статус: {task['status']}\n\n"
+        )
+    return response
+
+
 @dp.message_handler(lambda message: message.text == "📝 Мои задачи", state='*')
 async def my_tasks(message: types.Message, state: FSMContext):
     """Просмотр задач пользователя"""
@@ -196,31 +246,13 @@ async def my_tasks(message: types.Message, state: FSMContext):
         await message.answer(MESSAGES['not_registered'])
         return
     
-    tasks = await db.get_user_tasks(user_id)
+    page = await db.list_user_tasks(user_id)
     
-    if not tasks:
+    if not page['items']:
         await message.answer("У вас пока нет задач.")
         return
     
-    response = "<b>📝 Ваши задачи:</b>\n\n"
-    
-    status_emoji = {
-        'pending': '⏳',
-        'approved': '✅',
-        'rejected': '❌',
-        'completed': '🎉'
-    }
-    
-    for task in tasks:
-        emoji = status_emoji.get(task['status'], '❓')
-        response += (
-            f"{emoji} <b>{task['project_name']}</b>\n"
-            f"📝 {task['task_name']}\n"
-            f"Статус: {task['status']}\n"
-            f"Создано: {task['created_at'].strftime('%d.%m.%Y %H:%M')}\n\n"
-        )
-    
-    await message.answer(response)
+    await message.answer(format_user_tasks(page), reply_markup=get_tasks_page_keyboard('my', None, page))
 
 
 @dp.message_handler(lambda message: message.text == "✍️ Ввести данные", state='*')
@@ -235,16 +267,16 @@ async def start_write_data_from_main_menu(message: types.Message, state: FSMCont
         return
 
     # Берём последнюю ОДОБРЕННУЮ задачу
-    tasks = await db.get_user_tasks(user_id, status='approved')
-    if not tasks:
+    page = await db.list_user_tasks(user_id, status='approved', limit=1)
+    if not page['items']:
         await message.answer("У вас нет одобренных задач. Сначала дождитесь одобрения заявки.")
         return
 
-    latest = tasks[0]
+    latest = page['items'][0]
     project_name = latest['project_name']
     task_index = latest['task_index']
 
-    await state.update_data(note_project=project_name, note_task_index=task_index)
+    await state.update_data(note_project=project_name, note_task_index=task_index, note_task_name=latest['task_name'])
     await NoteStates.writing_note.set()
     await message.answer(
         f"✍️ Отправьте текст для записи в столбец K\n"
@@ -284,6 +316,71 @@ async def show_statistics(message: types.Message, state: FSMContext):
         for project in stats['top_projects']:
             response += f"• {project['project_name']}: {project['count']}\n"
     
+    scheduler_stats = sheets_scheduler.stats()
+    response += "\n<b>Google Sheets API:</b>\n"
+    for kind, title in (('read', 'Чтение'), ('write', 'Запись')):
+        lane = scheduler_stats[kind]
+        response += (
+            f"• {title}: в очереди {lane['queue_depth']}, "
+            f"ожидание {lane['avg_wait']:.2f}/{lane['max_wait']:.2f} с, "
+            f"429: {lane['throttled']}\n"
+        )
+    
+    pool_stats = db.pool_stats()
+    if pool_stats:
+        response += (
+            "\n<b>PostgreSQL:</b>\n"
+            f"• Соединения: занято {pool_stats['in_use']}, свободно {pool_stats['idle']}, "
+            f"всего {pool_stats['size']} (предел {pool_stats['limit']}), ждут {pool_stats['waiting']}\n"
+            f"• Ожидание p50/p95/max: {pool_stats['wait']['p50'] * 1000:.1f}/"
+            f"{pool_stats['wait']['p95'] * 1000:.1f}/{pool_stats['wait']['max'] * 1000:.1f} мс\n"
+            f"• Удержание p95: {pool_stats['hold']['p95'] * 1000:.1f} мс, "
+            f"медленных запросов: {pool_stats['slow_queries']}\n"
+        )
+        if pool_stats['replica']:
+            if pool_stats['replica_lag'] is None:
+                response += "• Реплика недоступна, отчёты читаются с основной БД\n"
+            else:
+                source = "реплики" if pool_stats['replica_in_use'] else "основной БД"
+                response += f"• Реплика: отставание {pool_stats['replica_lag']:.1f} с, отчёты с {source}\n"
+    
+    await message.answer(response)
+
+@dp.message_handler(lambda message: message.text == "📈 Аналитика", state='*')
+async def show_analytics(message: types.Message, state: FSMContext):
+    """Динамика заявок и активности по дням и проектам (только для админов)"""
+    await state.finish()
+    
+    if message.from_user.id not in ADMIN_IDS:
+        await message.answer("❌ У вас нет доступа к этой функции.")
+        return
+    
+    daily = await db.get_daily_analytics(ANALYTICS_DAYS)
+    projects = await db.get_project_analytics(ANALYTICS_DAYS)
+    
+    if not daily:
+        await message.answer("❌ Не удалось получить аналитику.")
+        return
+    
+    response = f"<b>📈 Аналитика за {ANALYTICS_DAYS} дн.</b>\n\n"
+    response += "<b>По дням</b> (заявки / ✅ / ❌ / 🎉 / 👥):\n"
+    for day in daily:
+        response += (
+            f"{day['day']:%d.%m}: {day['requested']} / {day['approved']} / "
+            f"{day['rejected']} / {day['completed']} / {day['active_users']}\n"
+        )
+    
+    if projects:
+        response += "\n<b>По проектам:</b>\n"
+        for project in projects:
+            response += (
+                f"• {project['project_name']}: заявок {project['requested']}, "
+                f"✅ {project['approved']}, ❌ {project['rejected']}, 🎉 {project['completed']}"
+            )
+            if project['avg_completion_seconds'] is not None:
+                response += f", выполнение ~{project['avg_completion_seconds'] / 3600:.1f} ч"
+            response += "\n"
+    
     await message.answer(response)
 
 @dp.message_handler(lambda message: message.text == "📑 Все задачи", state='*')
@@ -295,34 +392,55 @@ async def all_tasks(message: types.Message, state: FSMContext):
         await message.answer("❌ У вас нет доступа к этой функции.")
         return
     
-    tasks = await db.get_all_tasks(limit=50)
+    page = await db.list_all_tasks()
     
-    if not tasks:
+    if not page['items']:
         await message.answer("Задач пока нет.")
         return
     
-    response = "<b>📑 Все задачи (последние 50):</b>\n\n"
-    
-    status_emoji = {
-        'pending': '⏳',
-        'approved': '✅',
-        'rejected': '❌',
-        'completed': '🎉'
-    }
-    
-    for task in tasks[:20]:  # Показываем первые 20
-        emoji = status_emoji.get(task['status'], '❓')
-        response += (
-            f"{emoji} <b>{task['name']}</b> ({task['phone']})\n"
-            f"📋 {task['project_name']}\n"
-            f"📝 {task['task_name'][:50]}...\n"
-            f"Статус: {task['status']}\n\n"
-        )
+    await message.answer(
+        format_all_tasks(page, None),
+        reply_markup=get_tasks_page_keyboard('all', None, page, with_filters=True)
+    )
+
+@dp.callback_query_handler(lambda c: c.data.startswith('tpage_'), state='*')
+async def process_tasks_page(callback_query: types.CallbackQuery):
+    """Листание списков задач: tpage_{my|all}_{status}_{first|next|prev}[_{created_at}_{id}]"""
+    parts = callback_query.data.split('_')
+    if len(parts) not in (4, 6) or parts[1] not in ('my', 'all'):
+        await callback_query.answer("❌ Ошибка данных")
+        return
+    scope, status, direction = parts[1], parts[2], parts[3]
+    status = None if status == 'any' else status
+    cursor = None
+    if direction != 'first':
+        try:
+            cursor = (datetime.strptime(parts[4], CURSOR_TIME_FORMAT), int(parts[5]))
+        except (IndexError, ValueError):
+            await callback_query.answer("❌ Ошибка данных")
+            return
+    direction = 'prev' if direction == 'prev' else 'next'
     
-    if len(tasks) > 20:
-        response += f"\n... и еще {len(tasks) - 20} задач"
+    if scope == 'all':
+        if callback_query.from_user.id not in ADMIN_IDS:
+            await callback_query.answer("❌ Нет доступа")
+            return
+        page = await db.list_all_tasks(status=status, cursor=cursor, direction=direction)
+        text = format_all_tasks(page, status)
+        markup = get_tasks_page_keyboard('all', status, page, with_filters=True)
+    else:
+        page = await db.list_user_tasks(callback_query.from_user.id, status=status, cursor=cursor, direction=direction)
+        if not page['items']:
+            await callback_query.answer("Больше задач нет")
+            return
+        text = format_user_tasks(page)
+        markup = get_tasks_page_keyboard('my', status, page)
     
-    await message.answer(response)
+    try:
+        await callback_query.message.edit_text(text, reply_markup=markup)
+    except MessageNotModified:
+        pass
+    await callback_query.answer()
 
 @dp.callback_query_handler(lambda c: c.data.startswith('project_'), state=TaskSelectionStates.selecting_project)
 async def process_project_selection(callback_query: types.CallbackQuery, state: FSMContext):
@@ -330,7 +448,8 @@ async def process_project_selection(callback_query: types.CallbackQuery, state:
     project_name = callback_query.data.replace('project_', '')
     await state.update_data(selected_project=project_name)
     
-    tasks = await sheets_manager.get_tasks_from_project(project_name)
+    # Уже назначенные задачи не показываем - их данные есть в снимке листа
+    tasks = await sheets_manager.get_task_rows(project_name, include_assigned=False)
     
     if not tasks:
         await callback_query.message.edit_text(
@@ -364,12 +483,21 @@ async def process_task_selection(callback_query: types.CallbackQuery, state: FSM
         await callback_query.answer("❌ Задача не найдена")
         return
     
-    task_id = await db.create_task_request(user_id, project_name, task_name, task_index)
+    request = await db.create_task_request(user_id, project_name, task_name, task_index)
     
-    if not task_id:
+    if not request:
         await callback_query.answer("❌ Ошибка при создании запроса")
         return
     
+    task_id, created = request
+    if not created:
+        # Повторное нажатие: заявка уже у администраторов
+        await callback_query.message.edit_text(
+            MESSAGES['request_already_sent'].format(project=project_name, task=task_name)
+        )
+        await state.finish()
+        return
+    
     await callback_query.message.edit_text(
         MESSAGES['request_sent'].format(project=project_name, task=task_name)
     )
@@ -397,7 +525,7 @@ async def process_task_selection(callback_query: types.CallbackQuery, state: FSM
             await bot.send_message(
                 admin_id,
                 admin_message,
-                reply_markup=get_admin_keyboard(user_id, project_name, task_index)
+                reply_markup=get_admin_keyboard(task_id)
             )
         except Exception as e:
             logger.error(f"Error sending message to admin {admin_id}: {e}")
@@ -429,14 +557,13 @@ async def start_add_note(callback_query: types.CallbackQuery, state: FSMContext)
 
         # Разрешаем добавление комментария только для одобренных задач
         user_id = callback_query.from_user.id
-        approved_tasks = await db.get_user_tasks(user_id, status='approved')
-        is_approved = any(t['project_name'] == project_name and t['task_index'] == task_index for t in approved_tasks)
+        approved = await db.get_user_task(user_id, project_name, task_index, status='approved')
 
-        if not is_approved:
+        if not approved:
             await callback_query.answer("Задача ещё не одобрена администратором")
             return
 
-        await state.update_data(note_project=project_name, note_task_index=task_index)
+        await state.update_data(note_project=project_name, note_task_index=task_index, note_task_name=approved['task_name'])
         await NoteStates.writing_note.set()
         await callback_query.message.edit_text(
             f"✍️ Отправьте текст комментария для проекта <b>{project_name}</b>, задача #{task_index + 1}"
@@ -457,6 +584,7 @@ async def receive_note_and_save(message: types.Message, state: FSMContext):
     data = await state.get_data()
     project_name = data.get('note_project')
     task_index = data.get('note_task_index')
+    task_name = data.get('note_task_name')
 
     if project_name is None or task_index is None:
         await state.finish()
@@ -464,16 +592,26 @@ async def receive_note_and_save(message: types.Message, state: FSMContext):
         return
 
     # Проверяем, что задача одобрена
-    approved_tasks = await db.get_user_tasks(message.from_user.id, status='approved')
-    is_approved = any(t['project_name'] == project_name and t['task_index'] == int(task_index) for t in approved_tasks)
+    approved = await db.get_user_task(message.from_user.id, project_name, int(task_index), status='approved')
 
-    if not is_approved:
+    if not approved:
         await state.finish()
         await message.answer("❌ Задача ещё не одобрена администратором. Комментарий можно добавить после одобрения.")
         return
 
-    success = await sheets_manager.write_note_to_column_k(project_name, int(task_index), user_text)
+    # Комментарий пишется в ту задачу, которую пользователь видел при начале ввода
+    if task_name is not None and task_name != approved['task_name']:
+        await state.finish()
+        await message.answer("❌ Задача изменилась, пока вводился комментарий. Попробуйте заново через выбор задачи.")
+        return
+
+    success = await sheets_manager.write_note_to_column_k(
+        project_name, int(task_index), user_text, task_name=approved['task_name']
+    )
     if success:
+        # Своего запроса записи у комментария нет - в журнал через фоновую очередь
+        await db.log_action(message.from_user.id, 'note_added',
+                            f"Project: {project_name}, Task: {approved['task_name']}")
         await message.answer("✅ Комментарий сохранён в столбце K.")
     else:
         await message.answer("❌ Не удалось сохранить комментарий. Попробуйте позже.")
@@ -487,20 +625,38 @@ async def process_admin_decision(callback_query: types.CallbackQuery):
         await callback_query.answer("❌ У вас нет прав администратора")
         return
     
-    parts = callback_query.data.split('_')
-    action = parts[0]
-    user_id = int(parts[1])
-    project_name = parts[2]
-    task_index = int(parts[3])
+    action, _, payload = callback_query.data.partition('_')
+    if payload.isdigit():
+        task_id = int(payload)
+    else:
+        # Сообщения, отправленные до перехода на id: approve_{user_id}_{project}_{index}
+        try:
+            legacy_user_id, rest = payload.split('_', 1)
+            legacy_project, legacy_index = rest.rsplit('_', 1)
+            legacy = await db.get_user_task(int(legacy_user_id), legacy_project, int(legacy_index), status='pending')
+        except ValueError:
+            legacy = None
+        if not legacy:
+            await callback_query.answer(MESSAGES['admin_already_processed'])
+            return
+        task_id = legacy['id']
+    
+    status = 'approved' if action == 'approve' else 'rejected'
+    # Решение принимается только по открытой заявке: повторные нажатия и второй админ не меняют её
+    task = await db.update_task_status(task_id, status, callback_query.from_user.id, current_status='pending')
+    if not task:
+        await callback_query.answer(MESSAGES['admin_already_processed'])
+        return
     
+    user_id = task['user_id']
+    project_name = task['project_name']
+    task_index = task['task_index']
+    task_name = task['task_name']
     user = await db.get_user(user_id)
-    task_name = await sheets_manager.get_task_by_index(project_name, task_index)
     
     if action == 'approve':
-        await db.update_task_status(user_id, project_name, task_index, 'approved', callback_query.from_user.id)
-        
         success = await sheets_manager.assign_task_to_user(
-            project_name, task_index, user['name'], user['phone']
+            project_name, task_index, user['name'], user['phone'], task_name=task_name
         )
         
         if success:
@@ -527,11 +683,18 @@ async def process_admin_decision(callback_query: types.CallbackQuery):
             except Exception as e:
                 logger.error(f"Error sending approval message to user {user_id}: {e}")
         else:
+            # Возвращаем заявку в ожидание, чтобы решение можно было повторить
+            reverted = await db.update_task_status(
+                task_id, 'pending', callback_query.from_user.id, current_status='approved'
+            )
+            if not reverted:
+                # Пользователь уже подал новую заявку на эту задачу - старая закрывается
+                await db.update_task_status(
+                    task_id, 'cancelled', callback_query.from_user.id, current_status='approved'
+                )
             await callback_query.answer("❌ Ошибка при записи в таблицу")
     
     else:
-        await db.update_task_status(user_id, project_name, task_index, 'rejected', callback_query.from_user.id)
-        
         await callback_query.message.edit_text(
             MESSAGES['admin_rejected'].format(
                 name=user['name'],
@@ -554,8 +717,17 @@ async def on_startup(dp):
     logger.info("Starting bot...")
     
     try:
+        # Кэш прошлого запуска: данные отдаются сразу и перепроверяются в фоне
+        if CACHE_PERSIST_FILE:
+            cache.load(CACHE_PERSIST_FILE)
         await db.create_pool()
         await sheets_manager.initialize()
+        await sheets_writer.start(sheets_manager.values_batch_update)
+        await cache_warmer.start()
+        await change_detector.start()
+        cache.start_sweeper()
+        if CACHE_PERSIST_FILE:
+            cache.start_persistence(CACHE_PERSIST_FILE)
         
         # Уведомляем админов о запуске
         for admin_id in ADMIN_IDS:
@@ -574,6 +746,12 @@ async def on_shutdown(dp):
     logger.info("Shutting down bot...")
     
     try:
+        await cache.stop_sweeper()
+        await change_detector.stop()
+        await cache_warmer.stop()
+        await sheets_writer.stop()
+        if CACHE_PERSIST_FILE:
+            await cache.stop_persistence(CACHE_PERSIST_FILE)
         await db.close()
         
         # Уведомляем админов об остановке
@@ -588,10 +766,13 @@ async def on_shutdown(dp):
     logger.info("Bot stopped")
 
 if __name__ == '__main__':
-    executor.start_polling(
-        dp, 
-        on_startup=on_startup, 
-        on_shutdown=on_shutdown, 
-        skip_updates=True,
-        timeout=60
-    )
\ No newline at end of file
+    if BOT_MODE == 'webhook':
+        run_webhook(dp, on_startup=on_startup, on_shutdown=on_shutdown)
+    else:
+        executor.start_polling(
+            dp, 
+            on_startup=on_startup, 
+            on_shutdown=on_shutdown, 
+            skip_updates=True,
+            timeout=60
+        )
\ No newline at end of file
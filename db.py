@@ -1,29 +1,342 @@
+import asyncio
 import asyncpg
-from typing import Optional, List, Dict
+import json
+import time
+from datetime import date, datetime
+from typing import Optional, List, Dict, Tuple
 from utils.logger import logger
 from utils.decorators import async_retry
-from config import DATABASE_URL
+from utils.cache import cache, acached, LRUCache
+from utils.db_pool import InstrumentedPool
+from config import (
+    DATABASE_URL, ACTIVITY_FLUSH_INTERVAL, USER_CACHE_SIZE, USER_CACHE_TTL, USER_CACHE_NOTIFY,
+    ACTION_LOG_QUEUE_SIZE, ACTION_LOG_BATCH_SIZE, ACTION_LOG_FLUSH_INTERVAL, STATISTICS_CACHE_TTL,
+    ANALYTICS_DAYS, ANALYTICS_CACHE_TTL, LOG_PARTITIONS_AHEAD, LOG_RETENTION_MONTHS, LOG_RETENTION_MODE,
+    TASKS_PAGE_SIZE, DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, DB_COMMAND_TIMEOUT, DB_STATEMENT_CACHE_SIZE,
+    DB_STATEMENT_CACHE_LIFETIME, DB_CONNECTION_IDLE_LIFETIME, DB_SLOW_QUERY_MS, DB_POOL_ADAPTIVE,
+    DB_POOL_TARGET_WAIT_MS, DB_POOL_ADAPT_INTERVAL, REPLICA_DATABASE_URL, REPLICA_MAX_LAG,
+    REPLICA_LAG_CHECK_INTERVAL
+)
+
+# Канал уведомлений об изменении профиля пользователя (payload - user_id)
+USER_CHANNEL = 'user_changed'
+
+# Столбцы задачи для списков (без служебных полей)
+TASK_COLUMNS = 't.id, t.user_id, t.project_name, t.task_name, t.task_index, t.status, t.created_at'
+
+# Секции action_logs называются action_logs_pYYYYMM
+LOG_PARTITION_PREFIX = 'action_logs_p'
+
+# Период обслуживания секций журнала (сек)
+LOG_MAINTENANCE_INTERVAL = 24 * 60 * 60
+
+# Предельная пауза между попытками восстановить подписку на изменения профилей (сек)
+LISTENER_RETRY_MAX_DELAY = 60
+
+# Строк прежнего журнала за одну транзакцию переноса в секции
+LOG_MIGRATION_BATCH_SIZE = 10000
+
+# Попытки записи пачки журнала и предельная пауза между ними (сек)
+LOG_WRITE_ATTEMPTS = 5
+LOG_RETRY_MAX_DELAY = 60
+
+
+def _month_start(day: date, shift: int = 0) -> date:
+    """Первое число месяца, сдвинутого на shift месяцев"""
+    month = day.year * 12 + day.month - 1 + shift
+    return date(month // 12, month % 12 + 1, 1)
+
+
+def _partition_month(name: str) -> Optional[date]:
+    """Месяц секции по её имени (None для DEFAULT и чужих таблиц)"""
+    suffix = name[len(LOG_PARTITION_PREFIX):]
+    if not name.startswith(LOG_PARTITION_PREFIX) or len(suffix) != 6 or not suffix.isdigit():
+        return None
+    return date(int(suffix[:4]), int(suffix[4:]), 1)
+
+
+# Время выполнения задачи в секундах для дневных сводок ({row} - строка tasks)
+COMPLETION_SECONDS_SQL = '''
+    CASE WHEN {row}.status = 'completed'
+         THEN COALESCE(EXTRACT(EPOCH FROM {row}.completed_at - {row}.created_at), 0)::bigint
+         ELSE 0 END
+'''
+
+# День, которым датируется текущий статус задачи в сводках: решения - updated_at,
+# выполнение - completed_at. Общий для триггера и backfill_analytics.
+STATUS_DAY_SQL = '''
+    COALESCE(CASE WHEN {row}.status = 'completed' THEN {row}.completed_at END,
+             {row}.updated_at, {row}.created_at)::date
+'''
+
+
+def _rollup_status_sql(row: str, sign: str) -> str:
+    """Прибавление (sign='+') или вычитание (sign='-') статуса строки {row} в task_daily_stats"""
+    return f'''
+        INSERT INTO task_daily_stats
+            (day, project_name, approved, rejected, completed, completion_seconds)
+        VALUES (
+            {STATUS_DAY_SQL.format(row=row)}, {row}.project_name,
+            {sign}({row}.status = 'approved')::int,
+            {sign}({row}.status = 'rejected')::int,
+            {sign}({row}.status = 'completed')::int,
+            {sign}{COMPLETION_SECONDS_SQL.format(row=row)}
+        )
+        ON CONFLICT (day, project_name) DO UPDATE SET
+            approved = task_daily_stats.approved + EXCLUDED.approved,
+            rejected = task_daily_stats.rejected + EXCLUDED.rejected,
+            completed = task_daily_stats.completed + EXCLUDED.completed,
+            completion_seconds = task_daily_stats.completion_seconds + EXCLUDED.completion_seconds;
+    '''
+
+# Вся статистика за один проход по tasks: счётчики по проектам сворачиваются
+# в общие итоги, а топ проектов берётся из тех же счётчиков
+STATISTICS_QUERY = '''
+    WITH per_project AS (
+        SELECT project_name,
+               COUNT(*) AS count,
+               COUNT(*) FILTER (WHERE status = 'pending') AS pending,
+               COUNT(*) FILTER (WHERE status = 'approved') AS approved,
+               COUNT(*) FILTER (WHERE status = 'rejected') AS rejected,
+               COUNT(*) FILTER (WHERE status = 'completed') AS completed
+        FROM tasks
+        GROUP BY project_name
+    ), user_counts AS (
+        SELECT COUNT(*) AS total_users,
+               COUNT(*) FILTER (
+                   WHERE last_activity > CURRENT_TIMESTAMP - INTERVAL '7 days'
+               ) AS active_users
+        FROM users
+    )
+    SELECT u.total_users,
+           u.active_users,
+           COALESCE(SUM(p.count), 0)::bigint AS total_tasks,
+           COALESCE(SUM(p.pending), 0)::bigint AS pending_tasks,
+           COALESCE(SUM(p.approved), 0)::bigint AS approved_tasks,
+           COALESCE(SUM(p.rejected), 0)::bigint AS rejected_tasks,
+           COALESCE(SUM(p.completed), 0)::bigint AS completed_tasks,
+           (
+               SELECT COALESCE(json_agg(json_build_object('project_name', t.project_name, 'count', t.count)
+                                        ORDER BY t.count DESC), '[]')
+               FROM (SELECT project_name, count FROM per_project ORDER BY count DESC LIMIT 5) t
+           ) AS top_projects
+    FROM user_counts u
+    LEFT JOIN per_project p ON TRUE
+    GROUP BY u.total_users, u.active_users
+'''
+
+# Отставание реплики (сек): 0, если всё полученное уже применено (иначе на простаивающем
+# мастере время с последней транзакции росло бы без настоящего отставания)
+REPLICA_LAG_QUERY = '''
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END::float8
+'''
+
+# Запросы записи: изменение данных и запись в журнал одним оператором (одна транзакция,
+# один обмен с сервером). Готовятся при первом обращении на каждом соединении пула
+# и дальше берутся из кэша подготовленных запросов asyncpg. В init-хуке пула их готовить
+# нельзя: таблицы и индексы, на которые они опираются (например, idx_tasks_open_request
+# для ON CONFLICT), создаёт только create_tables.
+WRITE_STATEMENTS = {
+    'register_user': '''
+        WITH u AS (
+            INSERT INTO users (user_id, name, phone)
+            VALUES ($1, $2, $3)
+            ON CONFLICT (user_id) DO UPDATE
+            SET name = EXCLUDED.name, phone = EXCLUDED.phone, last_activity = CURRENT_TIMESTAMP
+            RETURNING *
+        ), logged AS (
+            INSERT INTO action_logs (user_id, action, details)
+            SELECT user_id, 'register', 'User registered: ' || name FROM u
+        )
+        SELECT * FROM u
+    ''',
+    'create_task_request': '''
+        WITH t AS (
+            INSERT INTO tasks (user_id, project_name, task_name, task_index)
+            VALUES ($1::bigint, $2::varchar, $3::text, $4::int)
+            ON CONFLICT (user_id, project_name, task_index) WHERE status = 'pending'
+            DO NOTHING
+            RETURNING id, user_id
+        ), logged AS (
+            INSERT INTO action_logs (user_id, action, details)
+            SELECT user_id, 'task_request', 'Project: ' || $2 || ', Task: ' || $3 FROM t
+        )
+        SELECT id, TRUE AS created FROM t
+        UNION ALL
+        SELECT id, FALSE FROM tasks
+        WHERE user_id = $1 AND project_name = $2 AND task_index = $4 AND status = 'pending'
+          AND NOT EXISTS (SELECT 1 FROM t)
+    ''',
+    'update_task_status': '''
+        WITH t AS (
+            UPDATE tasks
+            SET status = $2::varchar, updated_at = CURRENT_TIMESTAMP, admin_id = $3,
+                completed_at = CASE WHEN $2 = 'completed' THEN CURRENT_TIMESTAMP ELSE completed_at END
+            WHERE id = $1 AND ($4::varchar IS NULL OR status = $4)
+            RETURNING id, user_id, project_name, task_name, task_index, status, created_at
+        ), logged AS (
+            INSERT INTO action_logs (user_id, action, details)
+            SELECT user_id, 'task_status_update', 'Status: ' || status || ', Project: ' || project_name FROM t
+        )
+        SELECT * FROM t
+    ''',
+}
+
+
+def _query_name(query: str) -> str:
+    """Имя запроса для лога: ключ WRITE_STATEMENTS или начало текста"""
+    for name, statement in WRITE_STATEMENTS.items():
+        if statement == query:
+            return name
+    return ' '.join(query.split())[:120]
+
+
+class DatabaseConnection(asyncpg.Connection):
+    """Соединение пула с запросами записи и логом медленных запросов"""
+
+    # Число медленных запросов по всем соединениям процесса
+    slow_queries = 0
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if DB_SLOW_QUERY_MS:
+            self.add_query_logger(self._log_query)
+
+    def _log_query(self, record: asyncpg.connection.LoggedQuery):
+        # Logger вызывается на каждый запрос: текст разбираем только для медленных
+        if record.elapsed * 1000 < DB_SLOW_QUERY_MS:
+            return
+        DatabaseConnection.slow_queries += 1
+        logger.warning(f"Slow query {record.elapsed * 1000:.0f} ms: {_query_name(record.query)}")
+
+    async def fetchrow_statement(self, name: str, *args) -> Optional[asyncpg.Record]:
+        """Выполнение запроса из WRITE_STATEMENTS.
+
+        Запрос готовится один раз на соединение и хранится в кэше asyncpg: объект
+        PreparedStatement нельзя держать между выдачами соединения из пула, а кэш
+        переживает возврат в пул и сам готовит запрос заново после изменения схемы.
+        """
+        return await self.fetchrow(WRITE_STATEMENTS[name], *args)
+
 
 class Database:
     def __init__(self):
         self.pool = None
+        # Несохранённая активность: user_id -> время последнего действия (unix time)
+        self._activity: Dict[int, float] = {}
+        self._activity_task: Optional[asyncio.Task] = None
+        # Профили пользователей: заполняются при чтении и при регистрации
+        self.users = LRUCache(ttl=USER_CACHE_TTL, max_entries=USER_CACHE_SIZE)
+        # Отдельное соединение для LISTEN (соединения пула не держат подписки)
+        self._listener: Optional[asyncpg.Connection] = None
+        self._listener_task: Optional[asyncio.Task] = None
+        # Журнал действий пишется пачками через COPY; при переполнении очереди log_action ждёт
+        self._log_queue: asyncio.Queue = asyncio.Queue(maxsize=ACTION_LOG_QUEUE_SIZE)
+        self._log_batch_ready = asyncio.Event()
+        # Пачка, которую не удалось записать: повторяется с паузой до LOG_WRITE_ATTEMPTS раз
+        self._log_retry: List[tuple] = []
+        self._log_task: Optional[asyncio.Task] = None
+        self._maintenance_task: Optional[asyncio.Task] = None
+        # Реплика для отчётных запросов; None в replica_lag - реплика недоступна
+        self.replica: Optional[InstrumentedPool] = None
+        self.replica_lag: Optional[float] = None
+        self._replica_task: Optional[asyncio.Task] = None
     
     @async_retry(max_attempts=5)
     async def create_pool(self):
         """Создание пула соединений с базой данных"""
         try:
-            self.pool = await asyncpg.create_pool(
+            pool = await asyncpg.create_pool(
                 DATABASE_URL,
-                min_size=5,
-                max_size=20,
-                command_timeout=60
+                min_size=DB_POOL_MIN_SIZE,
+                max_size=DB_POOL_MAX_SIZE,
+                command_timeout=DB_COMMAND_TIMEOUT,
+                statement_cache_size=DB_STATEMENT_CACHE_SIZE,
+                max_cached_statement_lifetime=DB_STATEMENT_CACHE_LIFETIME,
+                max_inactive_connection_lifetime=DB_CONNECTION_IDLE_LIFETIME,
+                connection_class=DatabaseConnection
+            )
+            self.pool = InstrumentedPool(
+                pool, DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE,
+                adaptive=DB_POOL_ADAPTIVE,
+                target_wait=DB_POOL_TARGET_WAIT_MS / 1000,
+                adapt_interval=DB_POOL_ADAPT_INTERVAL
             )
             await self.create_tables()
+            await self.maintain_action_logs()
+            if self._activity_task is None or self._activity_task.done():
+                self._activity_task = asyncio.create_task(self._flush_activity_forever())
+            if self._log_task is None or self._log_task.done():
+                self._log_task = asyncio.create_task(self._write_logs_forever())
+            if self._maintenance_task is None or self._maintenance_task.done():
+                self._maintenance_task = asyncio.create_task(self._maintain_action_logs_forever())
+            if USER_CACHE_NOTIFY and self._listener is None and not await self._start_user_listener():
+                self._reconnect_user_listener()
+            if REPLICA_DATABASE_URL and self.replica is None:
+                await self._create_replica_pool()
+                if self._replica_task is None or self._replica_task.done():
+                    self._replica_task = asyncio.create_task(self._check_replica_lag_forever())
             logger.info("Database pool created successfully")
         except Exception as e:
             logger.error(f"Error creating database pool: {e}")
             raise
     
+    async def _create_replica_pool(self) -> bool:
+        """Пул реплики; без неё отчёты читаются с основной БД. False - реплика недоступна."""
+        try:
+            pool = await asyncpg.create_pool(
+                REPLICA_DATABASE_URL,
+                min_size=DB_POOL_MIN_SIZE,
+                max_size=DB_POOL_MAX_SIZE,
+                command_timeout=DB_COMMAND_TIMEOUT,
+                statement_cache_size=DB_STATEMENT_CACHE_SIZE,
+                max_cached_statement_lifetime=DB_STATEMENT_CACHE_LIFETIME,
+                max_inactive_connection_lifetime=DB_CONNECTION_IDLE_LIFETIME,
+                connection_class=DatabaseConnection
+            )
+        except Exception as e:
+            logger.error(f"Error creating replica pool, reports will read from primary: {e}")
+            return False
+        self.replica = InstrumentedPool(pool, DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE)
+        await self.check_replica_lag()
+        logger.info(f"Replica pool created, lag: {self.replica_lag}")
+        return True
+
+    async def check_replica_lag(self) -> Optional[float]:
+        """Замер отставания реплики; None - реплика недоступна"""
+        try:
+            async with self.replica.acquire(timeout=REPLICA_LAG_CHECK_INTERVAL) as conn:
+                lag = await conn.fetchval(REPLICA_LAG_QUERY, timeout=REPLICA_LAG_CHECK_INTERVAL)
+        except Exception as e:
+            if self.replica_lag is not None:
+                logger.warning(f"Replica unavailable, reading reports from primary: {e}")
+            lag = None
+        if lag is not None and lag > REPLICA_MAX_LAG and (self.replica_lag or 0) <= REPLICA_MAX_LAG:
+            logger.warning(f"Replica is {lag:.1f}s behind, reading reports from primary")
+        elif lag is not None and lag <= REPLICA_MAX_LAG and (self.replica_lag is None or self.replica_lag > REPLICA_MAX_LAG):
+            logger.info(f"Replica caught up ({lag:.1f}s), reading reports from replica")
+        self.replica_lag = lag
+        return lag
+
+    async def _check_replica_lag_forever(self):
+        while True:
+            await asyncio.sleep(REPLICA_LAG_CHECK_INTERVAL)
+            if self.replica is None:
+                # Реплика не подключилась при запуске - повторяем попытку
+                await self._create_replica_pool()
+            else:
+                await self.check_replica_lag()
+
+    def _reader(self):
+        """Пул для отчётных запросов: реплика, если она доступна и не отстала"""
+        if self.replica is not None and self.replica_lag is not None and self.replica_lag <= REPLICA_MAX_LAG:
+            return self.replica
+        return self.pool
+
     async def create_tables(self):
         """Создание необходимых таблиц"""
         async with self.pool.acquire() as conn:
@@ -56,38 +369,322 @@ class Database:
                 )
             ''')
             
-            # Таблица логов действий
+            # Таблица логов действий (секционирована по месяцам)
+            await self._create_action_logs(conn)
+            
+            # Outbox отложенной записи в Google Sheets
             await conn.execute('''
-                CREATE TABLE IF NOT EXISTS action_logs (
-                    id SERIAL PRIMARY KEY,
-                    user_id BIGINT,
-                    action VARCHAR(100) NOT NULL,
-                    details TEXT,
+                CREATE TABLE IF NOT EXISTS sheets_outbox (
+                    id BIGSERIAL PRIMARY KEY,
+                    range_name TEXT NOT NULL,
+                    cell_values JSONB NOT NULL,
+                    value_input_option VARCHAR(20) NOT NULL DEFAULT 'RAW',
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                 )
             ''')
             
+            # Зеркало строк задач из Google Sheets
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS sheet_rows (
+                    project_name VARCHAR(255) NOT NULL,
+                    row_number INTEGER NOT NULL,
+                    task_name TEXT NOT NULL,
+                    assignee_name TEXT NOT NULL DEFAULT '',
+                    assignee_phone TEXT NOT NULL DEFAULT '',
+                    note TEXT NOT NULL DEFAULT '',
+                    synced_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (project_name, row_number)
+                )
+            ''')
+            
+            # Уведомление других процессов об изменении профиля (не времени активности)
+            await conn.execute(f'''
+                CREATE OR REPLACE FUNCTION notify_user_changed() RETURNS trigger AS $$
+                BEGIN
+                    PERFORM pg_notify('{USER_CHANNEL}', COALESCE(NEW.user_id, OLD.user_id)::text);
+                    RETURN NULL;
+                END;
+                $$ LANGUAGE plpgsql
+            ''')
+            await conn.execute('''
+                DO $$
+                BEGIN
+                    IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'users_changed') THEN
+                        CREATE TRIGGER users_changed
+                        AFTER UPDATE OF name, phone, is_admin, is_active OR DELETE ON users
+                        FOR EACH ROW EXECUTE PROCEDURE notify_user_changed();
+                    END IF;
+                END
+                $$
+            ''')
+            
+            # Дневные сводки для аналитики (обновляются триггером и сбросом активности)
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS task_daily_stats (
+                    day DATE NOT NULL,
+                    project_name VARCHAR(255) NOT NULL,
+                    requested INTEGER NOT NULL DEFAULT 0,
+                    approved INTEGER NOT NULL DEFAULT 0,
+                    rejected INTEGER NOT NULL DEFAULT 0,
+                    completed INTEGER NOT NULL DEFAULT 0,
+                    completion_seconds BIGINT NOT NULL DEFAULT 0,
+                    PRIMARY KEY (day, project_name)
+                )
+            ''')
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS user_activity_days (
+                    day DATE NOT NULL,
+                    user_id BIGINT NOT NULL,
+                    PRIMARY KEY (day, user_id)
+                )
+            ''')
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS daily_activity (
+                    day DATE PRIMARY KEY,
+                    active_users INTEGER NOT NULL DEFAULT 0
+                )
+            ''')
+            await conn.execute(f'''
+                CREATE OR REPLACE FUNCTION rollup_task_daily_stats() RETURNS trigger AS $$
+                BEGIN
+                    IF TG_OP = 'INSERT' THEN
+                        INSERT INTO task_daily_stats (day, project_name, requested)
+                        VALUES (NEW.created_at::date, NEW.project_name, 1)
+                        ON CONFLICT (day, project_name)
+                        DO UPDATE SET requested = task_daily_stats.requested + 1;
+                    END IF;
+                    -- Сводка учитывает только текущий статус задачи (как backfill_analytics):
+                    -- прежний статус вычитается, новый прибавляется, поэтому возврат
+                    -- одобрения в pending убирает его из сводки
+                    IF TG_OP = 'UPDATE' AND OLD.status IN ('approved', 'rejected', 'completed') THEN
+                        {_rollup_status_sql('OLD', '-')}
+                    END IF;
+                    IF NEW.status IN ('approved', 'rejected', 'completed') THEN
+                        {_rollup_status_sql('NEW', '+')}
+                    END IF;
+                    RETURN NULL;
+                END;
+                $$ LANGUAGE plpgsql
+            ''')
+            await conn.execute('''
+                DO $$
+                BEGIN
+                    IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'tasks_daily_rollup') THEN
+                        CREATE TRIGGER tasks_daily_rollup
+                        AFTER INSERT OR UPDATE OF status ON tasks
+                        FOR EACH ROW EXECUTE PROCEDURE rollup_task_daily_stats();
+                    END IF;
+                END
+                $$
+            ''')
+            
             # Индексы для оптимизации
-            await conn.execute('CREATE INDEX IF NOT EXISTS idx_tasks_user_id ON tasks(user_id)')
-            await conn.execute('CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks(status)')
             await conn.execute('CREATE INDEX IF NOT EXISTS idx_tasks_project ON tasks(project_name)')
+            # Одиночные индексы по user_id и status покрыты составными ниже (ведущий столбец)
+            # и только замедляли запись - удаляем их из существующих баз
+            await conn.execute('DROP INDEX IF EXISTS idx_tasks_user_id')
+            await conn.execute('DROP INDEX IF EXISTS idx_tasks_status')
+            # Постраничные списки задач: курсор (created_at, id) по каждому фильтру
+            await conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_tasks_user_status_created
+                ON tasks(user_id, status, created_at DESC, id DESC)
+            ''')
+            await conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_tasks_user_created
+                ON tasks(user_id, created_at DESC, id DESC)
+            ''')
+            await conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_tasks_status_created
+                ON tasks(status, created_at DESC, id DESC)
+            ''')
+            await conn.execute('CREATE INDEX IF NOT EXISTS idx_tasks_created ON tasks(created_at DESC, id DESC)')
+            # Поиск заявки по ключу задачи (проверка одобрения перед комментарием)
+            await conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_tasks_user_task
+                ON tasks(user_id, project_name, task_index, created_at DESC)
+            ''')
+            await self._create_open_request_index(conn)
             await conn.execute('CREATE INDEX IF NOT EXISTS idx_logs_user_id ON action_logs(user_id)')
+            await conn.execute('CREATE INDEX IF NOT EXISTS idx_logs_created_at ON action_logs USING brin(created_at)')
             
             logger.info("Tables and indexes created successfully")
     
+    async def _create_open_request_index(self, conn: asyncpg.Connection):
+        """Одна открытая заявка на задачу; прежние дубли помечаются отменёнными"""
+        async with conn.transaction():
+            await conn.execute("SELECT pg_advisory_xact_lock(hashtext('tasks_open_request_index'))")
+            if await conn.fetchval("SELECT to_regclass('idx_tasks_open_request')"):
+                return
+            # Остаётся самая ранняя заявка: именно о ней первой узнали администраторы
+            cancelled = await conn.execute('''
+                UPDATE tasks SET status = 'cancelled', updated_at = CURRENT_TIMESTAMP
+                WHERE id IN (
+                    SELECT id FROM (
+                        SELECT id, ROW_NUMBER() OVER (
+                            PARTITION BY user_id, project_name, task_index ORDER BY created_at, id
+                        ) AS n
+                        FROM tasks
+                        WHERE status = 'pending'
+                    ) d
+                    WHERE d.n > 1
+                )
+            ''')
+            await conn.execute('''
+                CREATE UNIQUE INDEX idx_tasks_open_request
+                ON tasks(user_id, project_name, task_index)
+                WHERE status = 'pending'
+            ''')
+            logger.info(f"Open request index created, duplicate pending requests cancelled: {cancelled.split()[-1]}")
+
+    async def _create_action_logs(self, conn: asyncpg.Connection):
+        """Создание секционированного журнала. Прежняя таблица только переименовывается:
+        её строки переносит migrate_legacy_action_logs (utils/migrate_action_logs.py)."""
+        async with conn.transaction():
+            # Несколько процессов не должны переименовывать журнал одновременно
+            await conn.execute("SELECT pg_advisory_xact_lock(hashtext('action_logs_migration'))")
+            relkind = await conn.fetchval("SELECT relkind FROM pg_class WHERE oid = to_regclass('action_logs')")
+            legacy = relkind == 'r'
+            if legacy:
+                await conn.execute('ALTER TABLE action_logs RENAME TO action_logs_legacy')
+                await conn.execute('ALTER INDEX IF EXISTS idx_logs_user_id RENAME TO idx_logs_legacy_user_id')
+                await conn.execute('ALTER SEQUENCE IF EXISTS action_logs_id_seq RENAME TO action_logs_legacy_id_seq')
+
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS action_logs (
+                    id BIGSERIAL,
+                    user_id BIGINT,
+                    action VARCHAR(100) NOT NULL,
+                    details TEXT,
+                    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (id, created_at)
+                ) PARTITION BY RANGE (created_at)
+            ''')
+            # Запись вне подготовленных секций не должна падать
+            await conn.execute('CREATE TABLE IF NOT EXISTS action_logs_default PARTITION OF action_logs DEFAULT')
+
+            if legacy:
+                # Новые id продолжают прежние, чтобы перенесённые строки не пересекались с ними.
+                # MAX(id) читается по первичному ключу, таблица не сканируется.
+                await conn.execute('''
+                    SELECT setval(pg_get_serial_sequence('action_logs', 'id'), MAX(id))
+                    FROM action_logs_legacy
+                    HAVING MAX(id) IS NOT NULL
+                ''')
+                logger.warning("action_logs is now partitioned; the old table was renamed to action_logs_legacy, "
+                               "run utils/migrate_action_logs.py to move its rows")
+
+    async def migrate_legacy_action_logs(self, batch_size: int = LOG_MIGRATION_BATCH_SIZE) -> int:
+        """Перенос строк action_logs_legacy в секции пачками по batch_size.
+        Каждая пачка - отдельная короткая транзакция, поэтому перенос можно прервать
+        и продолжить. Пустая прежняя таблица удаляется. Возвращает число перенесённых строк."""
+        async with self.pool.acquire() as conn:
+            if await conn.fetchval("SELECT to_regclass('action_logs_legacy')") is None:
+                return 0
+
+            oldest = await conn.fetchval('SELECT MIN(created_at) FROM action_logs_legacy')
+            if oldest is not None:
+                # Секции прошлых месяцев; текущий и будущие создаёт maintain_action_logs
+                for month in self._partition_months(_month_start(oldest.date())):
+                    await conn.execute(self._partition_ddl(month))
+
+            moved = 0
+            while True:
+                async with conn.transaction():
+                    count = await conn.fetchval('''
+                        WITH batch AS (
+                            DELETE FROM action_logs_legacy
+                            WHERE id IN (SELECT id FROM action_logs_legacy ORDER BY id LIMIT $1)
+                            RETURNING id, user_id, action, details, created_at
+                        ), moved AS (
+                            INSERT INTO action_logs (id, user_id, action, details, created_at)
+                            SELECT id, user_id, action, details, COALESCE(created_at, CURRENT_TIMESTAMP)
+                            FROM batch
+                            RETURNING 1
+                        )
+                        SELECT COUNT(*) FROM moved
+                    ''', batch_size)
+                if not count:
+                    break
+                moved += count
+                logger.info(f"Moved {moved} legacy action_logs rows")
+
+            await conn.execute('DROP TABLE IF EXISTS action_logs_legacy')
+        logger.info(f"action_logs_legacy migrated ({moved} rows) and dropped")
+        return moved
+
+    @staticmethod
+    def _partition_months(first_month: date) -> List[date]:
+        """Месяцы от first_month до LOG_PARTITIONS_AHEAD месяцев вперёд"""
+        last_month = _month_start(date.today(), LOG_PARTITIONS_AHEAD)
+        months = []
+        while first_month <= last_month:
+            months.append(first_month)
+            first_month = _month_start(first_month, 1)
+        return months
+
+    @staticmethod
+    def _partition_ddl(month: date) -> str:
+        return f'''
+            CREATE TABLE IF NOT EXISTS {LOG_PARTITION_PREFIX}{month:%Y%m} PARTITION OF action_logs
+            FOR VALUES FROM ('{month.isoformat()}') TO ('{_month_start(month, 1).isoformat()}')
+        '''
+
+    async def maintain_action_logs(self) -> List[str]:
+        """Секции на месяцы вперёд и отсоединение/удаление секций старше LOG_RETENTION_MONTHS.
+        Возвращает имена убранных секций."""
+        removed = []
+        async with self.pool.acquire() as conn:
+            for month in self._partition_months(_month_start(date.today())):
+                try:
+                    await conn.execute(self._partition_ddl(month))
+                except Exception as e:
+                    # Например, в DEFAULT уже есть строки этого месяца
+                    logger.error(f"Error creating action_logs partition for {month:%Y-%m}: {e}")
+
+            if LOG_RETENTION_MONTHS <= 0:
+                return removed
+            cutoff = _month_start(date.today(), -LOG_RETENTION_MONTHS)
+            partitions = await conn.fetch('''
+                SELECT c.relname
+                FROM pg_inherits i
+                JOIN pg_class c ON c.oid = i.inhrelid
+                WHERE i.inhparent = 'action_logs'::regclass
+                ORDER BY c.relname
+            ''')
+            for partition in partitions:
+                name = partition['relname']
+                month = _partition_month(name)
+                # Секция убирается, только если весь её месяц старше границы хранения
+                if month is None or _month_start(month, 1) > cutoff:
+                    continue
+                try:
+                    if LOG_RETENTION_MODE == 'drop':
+                        await conn.execute(f'DROP TABLE {name}')
+                    else:
+                        await conn.execute(f'ALTER TABLE action_logs DETACH PARTITION {name}')
+                    removed.append(name)
+                except Exception as e:
+                    logger.error(f"Error removing action_logs partition {name}: {e}")
+        if removed:
+            logger.info(f"action_logs retention ({LOG_RETENTION_MODE}): {removed}")
+        return removed
+
+    async def _maintain_action_logs_forever(self):
+        while True:
+            await asyncio.sleep(LOG_MAINTENANCE_INTERVAL)
+            try:
+                await self.maintain_action_logs()
+            except Exception as e:
+                logger.error(f"Error maintaining action_logs partitions: {e}")
+
     @async_retry()
     async def register_user(self, user_id: int, name: str, phone: str) -> bool:
         """Регистрация нового пользователя"""
         async with self.pool.acquire() as conn:
             try:
-                await conn.execute('''
-                    INSERT INTO users (user_id, name, phone) 
-                    VALUES ($1, $2, $3) 
-                    ON CONFLICT (user_id) DO UPDATE 
-                    SET name = $2, phone = $3, last_activity = CURRENT_TIMESTAMP
-                ''', user_id, name, phone)
+                row = await conn.fetchrow_statement('register_user', user_id, name, phone)
+                self.users.set(user_id, dict(row))
                 
-                await self.log_action(user_id, 'register', f'User registered: {name}')
                 logger.info(f"User {user_id} registered successfully")
                 return True
             except Exception as e:
@@ -97,165 +694,596 @@ class Database:
     @async_retry()
     async def get_user(self, user_id: int) -> Optional[Dict]:
         """Получение информации о пользователе"""
+        # Без подписки на изменения кэш мог пропустить правки из других процессов
+        user = self.users.get(user_id) if self._user_cache_trusted else None
+        if user is not None:
+            self.track_activity(user_id)
+            return dict(user)
+
         async with self.pool.acquire() as conn:
             try:
                 row = await conn.fetchrow('SELECT * FROM users WHERE user_id = $1', user_id)
                 if row:
-                    # Обновляем время последней активности
-                    await conn.execute(
-                        'UPDATE users SET last_activity = CURRENT_TIMESTAMP WHERE user_id = $1',
-                        user_id
-                    )
+                    # Время активности копится в памяти и пишется пачкой
+                    self.track_activity(user_id)
+                    self.users.set(user_id, dict(row))
                 return dict(row) if row else None
             except Exception as e:
                 logger.error(f"Error getting user {user_id}: {e}")
                 return None
     
+    @property
+    def _user_cache_trusted(self) -> bool:
+        """Кэш профилей можно читать: уведомления не нужны или подписка активна"""
+        return not USER_CACHE_NOTIFY or self._listener is not None
+
+    async def _start_user_listener(self) -> bool:
+        """Подписка на изменения профилей из других процессов. False - не удалось."""
+        listener = None
+        try:
+            listener = await asyncpg.connect(DATABASE_URL)
+            await listener.add_listener(USER_CHANNEL, self._on_user_changed)
+            listener.add_termination_listener(self._on_listener_lost)
+        except Exception as e:
+            # Пока подписки нет, профили читаются из БД в обход кэша
+            logger.error(f"Error subscribing to user profile changes: {e}")
+            if listener is not None:
+                listener.terminate()
+            return False
+        self._listener = listener
+        logger.info("Listening for user profile changes")
+        return True
+
+    def _reconnect_user_listener(self):
+        if self._listener_task is None or self._listener_task.done():
+            self._listener_task = asyncio.ensure_future(self._reconnect_user_listener_forever())
+
+    async def _reconnect_user_listener_forever(self):
+        delay = 1
+        while self.pool is not None:
+            await asyncio.sleep(delay)
+            if await self._start_user_listener():
+                # Уведомления за время без подписки потеряны
+                self.users.clear()
+                return
+            delay = min(delay * 2, LISTENER_RETRY_MAX_DELAY)
+
+    def _on_user_changed(self, connection, pid: int, channel: str, payload: str):
+        try:
+            self.users.delete(int(payload))
+        except ValueError:
+            logger.warning(f"Unexpected {channel} payload: {payload}")
+
+    def _on_listener_lost(self, connection):
+        # Пропущенные уведомления не восстановить - сбрасываем кэш и переподписываемся
+        logger.warning("User profile listener connection lost, clearing user cache")
+        self.users.clear()
+        self._listener = None
+        if self.pool is not None:
+            self._reconnect_user_listener()
+
+    def track_activity(self, user_id: int):
+        """Отметка активности пользователя (сохраняется flush_activity)"""
+        self._activity[user_id] = time.time()
+
+    async def flush_activity(self) -> int:
+        """Запись накопленной активности одним UPDATE. Возвращает число пользователей."""
+        if not self._activity or self.pool is None:
+            return 0
+        pending, self._activity = self._activity, {}
+        try:
+            async with self.pool.acquire() as conn, conn.transaction():
+                # to_timestamp переводит время в часовой пояс сессии, как CURRENT_TIMESTAMP
+                await conn.execute('''
+                    UPDATE users u
+                    SET last_activity = GREATEST(u.last_activity, to_timestamp(a.ts))
+                    FROM unnest($1::bigint[], $2::float8[]) AS a(user_id, ts)
+                    WHERE u.user_id = a.user_id
+                ''', list(pending), list(pending.values()))
+                # Счётчик активных за день растёт только для впервые замеченных в этот день
+                await conn.execute('''
+                    WITH new_days AS (
+                        INSERT INTO user_activity_days (day, user_id)
+                        SELECT DISTINCT to_timestamp(a.ts)::date, a.user_id
+                        FROM unnest($1::bigint[], $2::float8[]) AS a(user_id, ts)
+                        ON CONFLICT DO NOTHING
+                        RETURNING day
+                    )
+                    INSERT INTO daily_activity (day, active_users)
+                    SELECT day, COUNT(*) FROM new_days GROUP BY day
+                    ON CONFLICT (day) DO UPDATE
+                    SET active_users = daily_activity.active_users + EXCLUDED.active_users
+                ''', list(pending), list(pending.values()))
+            return len(pending)
+        except Exception as e:
+            logger.error(f"Error flushing user activity: {e}")
+            # Возвращаем несохранённое, не затирая более свежие отметки
+            for user_id, ts in pending.items():
+                if self._activity.get(user_id, 0) < ts:
+                    self._activity[user_id] = ts
+            return 0
+
+    async def _flush_activity_forever(self):
+        while True:
+            await asyncio.sleep(ACTIVITY_FLUSH_INTERVAL)
+            await self.flush_activity()
+
     @async_retry()
-    async def create_task_request(self, user_id: int, project_name: str, task_name: str, task_index: int) -> Optional[int]:
-        """Создание запроса на задачу"""
+    async def create_task_request(self, user_id: int, project_name: str, task_name: str,
+                                  task_index: int) -> Optional[Tuple[int, bool]]:
+        """Создание запроса на задачу: (id заявки, создана ли она сейчас)"""
         async with self.pool.acquire() as conn:
             try:
-                task_id = await conn.fetchval('''
-                    INSERT INTO tasks (user_id, project_name, task_name, task_index) 
-                    VALUES ($1, $2, $3, $4) 
-                    RETURNING id
-                ''', user_id, project_name, task_name, task_index)
+                row = await conn.fetchrow_statement('create_task_request', user_id, project_name, task_name, task_index)
+                if row is None:
+                    # Открытая заявка создана параллельно и ещё не видна в снимке оператора
+                    # либо уже обработана - перечитываем
+                    task_id = await conn.fetchval('''
+                        SELECT id FROM tasks
+                        WHERE user_id = $1 AND project_name = $2 AND task_index = $3 AND status = 'pending'
+                    ''', user_id, project_name, task_index)
+                    if task_id is None:
+                        return None
+                    row = {'id': task_id, 'created': False}
+                
+                if not row['created']:
+                    logger.info(f"Task request {row['id']} already open for user {user_id}")
+                    return row['id'], False
                 
-                await self.log_action(user_id, 'task_request', f'Project: {project_name}, Task: {task_name}')
-                logger.info(f"Task request created with ID {task_id}")
-                return task_id
+                self._invalidate_tasks(user_id)
+                logger.info(f"Task request created with ID {row['id']}")
+                return row['id'], True
             except Exception as e:
                 logger.error(f"Error creating task request: {e}")
                 return None
     
     @async_retry()
-    async def update_task_status(self, user_id: int, project_name: str, task_index: int, status: str, admin_id: Optional[int] = None) -> bool:
-        """Обновление статуса задачи"""
+    async def update_task_status(self, task_id: int, status: str, admin_id: Optional[int] = None,
+                                 current_status: Optional[str] = None) -> Optional[Dict]:
+        """Обновление статуса задачи по id; с current_status - только из этого статуса"""
         async with self.pool.acquire() as conn:
             try:
-                query = '''
-                    UPDATE tasks 
-                    SET status = $1, updated_at = CURRENT_TIMESTAMP, admin_id = $5
-                '''
+                row = await conn.fetchrow_statement('update_task_status', task_id, status, admin_id, current_status)
+                if not row:
+                    logger.info(f"Task {task_id} not updated to {status}: not found or already processed")
+                    return None
                 
-                if status == 'completed':
-                    query += ', completed_at = CURRENT_TIMESTAMP'
-                
-                query += ' WHERE user_id = $2 AND project_name = $3 AND task_index = $4'
-                
-                await conn.execute(query, status, user_id, project_name, task_index, admin_id)
-                
-                await self.log_action(user_id, 'task_status_update', f'Status: {status}, Project: {project_name}')
-                logger.info(f"Task status updated to {status} for user {user_id}")
-                return True
+                self._invalidate_tasks(row['user_id'])
+                logger.info(f"Task {task_id} status updated to {status} for user {row['user_id']}")
+                return dict(row)
+            except asyncpg.UniqueViolationError:
+                # Возврат в pending, когда у пользователя уже есть новая открытая заявка на эту задачу
+                logger.info(f"Task {task_id} not updated to {status}: another open request exists")
+                return None
             except Exception as e:
                 logger.error(f"Error updating task status: {e}")
-                return False
+                return None
     
+    @staticmethod
+    def _invalidate_tasks(user_id: int):
+        """Сброс закэшированных списков задач после изменения задач"""
+        cache.invalidate_tag(f"tasks:{user_id}")
+        cache.invalidate_tag("tasks")
+
+    @acached("user_task:{user_id}:{project_name}:{task_index}:{status}", ttl=60, tags=["tasks:{user_id}"])
     @async_retry()
-    async def get_user_tasks(self, user_id: int, status: Optional[str] = None) -> List[Dict]:
-        """Получение задач пользователя"""
+    async def get_user_task(self, user_id: int, project_name: str, task_index: int,
+                            status: Optional[str] = None) -> Optional[Dict]:
+        """Последняя заявка пользователя на конкретную задачу проекта"""
+        args = [user_id, project_name, task_index]
+        status_filter = ''
+        if status:
+            args.append(status)
+            status_filter = 'AND t.status = $4'
         async with self.pool.acquire() as conn:
             try:
-                if status:
-                    rows = await conn.fetch('''
-                        SELECT * FROM tasks 
-                        WHERE user_id = $1 AND status = $2 
-                        ORDER BY created_at DESC
-                    ''', user_id, status)
-                else:
-                    rows = await conn.fetch('''
-                        SELECT * FROM tasks 
-                        WHERE user_id = $1 
-                        ORDER BY created_at DESC
-                    ''', user_id)
-                
-                return [dict(row) for row in rows]
+                row = await conn.fetchrow(f'''
+                    SELECT {TASK_COLUMNS}
+                    FROM tasks t
+                    WHERE t.user_id = $1 AND t.project_name = $2 AND t.task_index = $3 {status_filter}
+                    ORDER BY t.created_at DESC, t.id DESC
+                    LIMIT 1
+                ''', *args)
+                return dict(row) if row else None
             except Exception as e:
-                logger.error(f"Error getting user tasks: {e}")
-                return []
-    
+                logger.error(f"Error getting user task: {e}")
+                return None
+
+    @acached("user_tasks_page:{user_id}:{status}:{cursor}:{direction}:{limit}", ttl=60,
+             tags=["tasks:{user_id}"], is_negative=lambda page: not page['items'])
     @async_retry()
-    async def get_all_tasks(self, status: Optional[str] = None, limit: int = 100) -> List[Dict]:
-        """Получение всех задач (для администраторов)"""
-        async with self.pool.acquire() as conn:
+    async def list_user_tasks(self, user_id: int, status: Optional[str] = None,
+                              cursor: Optional[Tuple[datetime, int]] = None, direction: str = 'next',
+                              limit: int = TASKS_PAGE_SIZE) -> Dict:
+        """Страница задач пользователя, новые сначала (см. _fetch_page)"""
+        conditions, args = ['t.user_id = $1'], [user_id]
+        if status:
+            args.append(status)
+            conditions.append(f't.status = ${len(args)}')
+        return await self._fetch_page(
+            f'SELECT {TASK_COLUMNS} FROM tasks t', conditions, args, cursor, direction, limit
+        )
+
+    @acached("all_tasks_page:{status}:{cursor}:{direction}:{limit}", ttl=30,
+             tags=["tasks"], is_negative=lambda page: not page['items'])
+    @async_retry()
+    async def list_all_tasks(self, status: Optional[str] = None,
+                             cursor: Optional[Tuple[datetime, int]] = None, direction: str = 'next',
+                             limit: int = TASKS_PAGE_SIZE) -> Dict:
+        """Страница всех задач с данными пользователей (для администраторов)"""
+        conditions, args = [], []
+        if status:
+            args.append(status)
+            conditions.append(f't.status = ${len(args)}')
+        # Отчётный список: допускает отставание реплики, в отличие от списка своих задач
+        return await self._fetch_page(
+            f'SELECT {TASK_COLUMNS}, u.name, u.phone FROM tasks t JOIN users u ON t.user_id = u.user_id',
+            conditions, args, cursor, direction, limit, pool=self._reader()
+        )
+
+    async def _fetch_page(self, query: str, conditions: List[str], args: list,
+                          cursor: Optional[Tuple[datetime, int]], direction: str, limit: int,
+                          pool=None) -> Dict:
+        """Keyset-пагинация по (created_at, id): 'next' - более старые, 'prev' - более новые.
+
+        Возвращает {'items': [...], 'has_next': bool, 'has_prev': bool}; курсоры
+        соседних страниц берутся из первой и последней записи. pool - по умолчанию основной.
+        """
+        backward = direction == 'prev'
+        args = list(args)
+        conditions = list(conditions)
+        if cursor is not None:
+            args.extend(cursor)
+            conditions.append(f"(t.created_at, t.id) {'>' if backward else '<'} (${len(args) - 1}, ${len(args)})")
+        order = 'ASC' if backward else 'DESC'
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        # Лишняя запись показывает, есть ли ещё страница в эту сторону
+        args.append(limit + 1)
+        sql = f"{query} {where} ORDER BY t.created_at {order}, t.id {order} LIMIT ${len(args)}"
+
+        async with (pool or self.pool).acquire() as conn:
             try:
-                if status:
-                    rows = await conn.fetch('''
-                        SELECT t.*, u.name, u.phone 
-                        FROM tasks t
-                        JOIN users u ON t.user_id = u.user_id
-                        WHERE t.status = $1
-                        ORDER BY t.created_at DESC
-                        LIMIT $2
-                    ''', status, limit)
-                else:
-                    rows = await conn.fetch('''
-                        SELECT t.*, u.name, u.phone 
-                        FROM tasks t
-                        JOIN users u ON t.user_id = u.user_id
-                        ORDER BY t.created_at DESC
-                        LIMIT $1
-                    ''', limit)
-                
-                return [dict(row) for row in rows]
+                rows = [dict(row) for row in await conn.fetch(sql, *args)]
             except Exception as e:
-                logger.error(f"Error getting all tasks: {e}")
-                return []
-    
+                logger.error(f"Error listing tasks: {e}")
+                return {'items': [], 'has_next': False, 'has_prev': False}
+
+        more = len(rows) > limit
+        rows = rows[:limit]
+        if backward:
+            rows.reverse()
+            return {'items': rows, 'has_next': True, 'has_prev': more}
+        return {'items': rows, 'has_next': more, 'has_prev': cursor is not None}
+
+    @acached("statistics", ttl=STATISTICS_CACHE_TTL)
     @async_retry()
     async def get_statistics(self) -> Dict:
-        """Получение статистики"""
-        async with self.pool.acquire() as conn:
+        """Получение статистики (один запрос, результат кэшируется на STATISTICS_CACHE_TTL)"""
+        reader = self._reader()
+        if reader is self.pool:
+            # Активность за последние секунды должна попасть в подсчёт активных.
+            # На реплике только что записанное может быть ещё не видно, поэтому там
+            # активные считаются по уже сброшенным отметкам (расхождение - секунды
+            # на окне в 7 дней)
+            await self.flush_activity()
+        async with reader.acquire() as conn:
             try:
-                stats = {}
-                
-                # Общее количество пользователей
-                stats['total_users'] = await conn.fetchval('SELECT COUNT(*) FROM users')
-                
-                # Активные пользователи (за последние 7 дней)
-                stats['active_users'] = await conn.fetchval('''
-                    SELECT COUNT(*) FROM users 
-                    WHERE last_activity > CURRENT_TIMESTAMP - INTERVAL '7 days'
-                ''')
-                
-                # Статистика по задачам
-                stats['total_tasks'] = await conn.fetchval('SELECT COUNT(*) FROM tasks')
-                stats['pending_tasks'] = await conn.fetchval("SELECT COUNT(*) FROM tasks WHERE status = 'pending'")
-                stats['approved_tasks'] = await conn.fetchval("SELECT COUNT(*) FROM tasks WHERE status = 'approved'")
-                stats['rejected_tasks'] = await conn.fetchval("SELECT COUNT(*) FROM tasks WHERE status = 'rejected'")
-                stats['completed_tasks'] = await conn.fetchval("SELECT COUNT(*) FROM tasks WHERE status = 'completed'")
-                
-                # Топ проектов
-                top_projects = await conn.fetch('''
-                    SELECT project_name, COUNT(*) as count 
-                    FROM tasks 
-                    GROUP BY project_name 
-                    ORDER BY count DESC 
-                    LIMIT 5
-                ''')
-                stats['top_projects'] = [dict(row) for row in top_projects]
-                
+                row = await conn.fetchrow(STATISTICS_QUERY)
+                stats = dict(row)
+                stats['top_projects'] = json.loads(stats['top_projects'])
                 return stats
             except Exception as e:
                 logger.error(f"Error getting statistics: {e}")
                 return {}
     
+    @acached("analytics_daily:{days}", ttl=ANALYTICS_CACHE_TTL, tags=["analytics"])
+    @async_retry()
+    async def get_daily_analytics(self, days: int = ANALYTICS_DAYS) -> List[Dict]:
+        """Итоги по дням за последние days дней (из дневных сводок)"""
+        async with self._reader().acquire() as conn:
+            try:
+                rows = await conn.fetch('''
+                    SELECT d.day::date AS day,
+                           COALESCE(SUM(s.requested), 0)::int AS requested,
+                           COALESCE(SUM(s.approved), 0)::int AS approved,
+                           COALESCE(SUM(s.rejected), 0)::int AS rejected,
+                           COALESCE(SUM(s.completed), 0)::int AS completed,
+                           COALESCE(a.active_users, 0) AS active_users
+                    FROM generate_series(CURRENT_DATE - ($1::int - 1), CURRENT_DATE, INTERVAL '1 day') AS d(day)
+                    LEFT JOIN task_daily_stats s ON s.day = d.day::date
+                    LEFT JOIN daily_activity a ON a.day = d.day::date
+                    GROUP BY d.day, a.active_users
+                    ORDER BY d.day
+                ''', days)
+                return [dict(row) for row in rows]
+            except Exception as e:
+                logger.error(f"Error getting daily analytics: {e}")
+                return []
+
+    @acached("analytics_projects:{days}", ttl=ANALYTICS_CACHE_TTL, tags=["analytics"])
     @async_retry()
+    async def get_project_analytics(self, days: int = ANALYTICS_DAYS) -> List[Dict]:
+        """Итоги по проектам за последние days дней со средним временем выполнения"""
+        async with self._reader().acquire() as conn:
+            try:
+                rows = await conn.fetch('''
+                    SELECT project_name,
+                           SUM(requested)::int AS requested,
+                           SUM(approved)::int AS approved,
+                           SUM(rejected)::int AS rejected,
+                           SUM(completed)::int AS completed,
+                           SUM(completion_seconds)::float8 / NULLIF(SUM(completed), 0) AS avg_completion_seconds
+                    FROM task_daily_stats
+                    WHERE day > CURRENT_DATE - $1::int
+                    GROUP BY project_name
+                    ORDER BY requested DESC
+                ''', days)
+                return [dict(row) for row in rows]
+            except Exception as e:
+                logger.error(f"Error getting project analytics: {e}")
+                return []
+
+    async def backfill_analytics(self) -> Dict[str, int]:
+        """Пересборка дневных сводок из tasks и action_logs"""
+        async with self.pool.acquire() as conn, conn.transaction():
+            # Триггер и сброс активности не должны дописывать в сводки, пока они пересобираются
+            await conn.execute('LOCK TABLE tasks, user_activity_days IN SHARE ROW EXCLUSIVE MODE')
+            await conn.execute('TRUNCATE task_daily_stats')
+            # Учитывается только текущий статус задачи в день его установки - как в триггере
+            await conn.execute(f'''
+                INSERT INTO task_daily_stats
+                    (day, project_name, requested, approved, rejected, completed, completion_seconds)
+                SELECT day, project_name, SUM(requested), SUM(approved), SUM(rejected),
+                       SUM(completed), SUM(completion_seconds)
+                FROM (
+                    SELECT created_at::date AS day, project_name,
+                           1 AS requested, 0 AS approved, 0 AS rejected, 0 AS completed,
+                           0::bigint AS completion_seconds
+                    FROM tasks
+                    UNION ALL
+                    SELECT {STATUS_DAY_SQL.format(row='tasks')},
+                           project_name, 0,
+                           (status = 'approved')::int,
+                           (status = 'rejected')::int,
+                           (status = 'completed')::int,
+                           {COMPLETION_SECONDS_SQL.format(row='tasks')}
+                    FROM tasks
+                    WHERE status IN ('approved', 'rejected', 'completed')
+                ) events
+                GROUP BY day, project_name
+            ''')
+            await conn.execute('''
+                INSERT INTO user_activity_days (day, user_id)
+                SELECT DISTINCT created_at::date, user_id
+                FROM action_logs
+                WHERE user_id IS NOT NULL
+                ON CONFLICT DO NOTHING
+            ''')
+            await conn.execute('TRUNCATE daily_activity')
+            await conn.execute('''
+                INSERT INTO daily_activity (day, active_users)
+                SELECT day, COUNT(*) FROM user_activity_days GROUP BY day
+            ''')
+            result = {
+                'task_days': await conn.fetchval('SELECT COUNT(*) FROM task_daily_stats'),
+                'activity_days': await conn.fetchval('SELECT COUNT(*) FROM daily_activity'),
+            }
+        cache.invalidate_tag("analytics")
+        logger.info(f"Analytics backfilled: {result}")
+        return result
+
     async def log_action(self, user_id: int, action: str, details: str = None):
-        """Логирование действий пользователя"""
+        """Логирование действий пользователя (запись в БД - в фоне, пачками)"""
+        # Ждать приходится, только если очередь заполнена
+        await self._log_queue.put((user_id, action, details))
+        if self._log_queue.qsize() >= ACTION_LOG_BATCH_SIZE:
+            self._log_batch_ready.set()
+
+    async def _write_logs_forever(self):
+        failures = 0
+        while True:
+            if failures:
+                # Незаписанная пачка ждёт в _log_retry; пауза растёт с каждой неудачей
+                await asyncio.sleep(min(ACTION_LOG_FLUSH_INTERVAL * 2 ** failures, LOG_RETRY_MAX_DELAY))
+            else:
+                # Пачка уходит по заполнении или по истечении интервала
+                try:
+                    await asyncio.wait_for(self._log_batch_ready.wait(), ACTION_LOG_FLUSH_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                self._log_batch_ready.clear()
+            while self._log_retry or not self._log_queue.empty():
+                self._log_retry = self._log_retry or self._take_logs()
+                if await self._write_logs(self._log_retry):
+                    self._log_retry, failures = [], 0
+                    continue
+                failures += 1
+                if failures >= LOG_WRITE_ATTEMPTS:
+                    logger.error(f"Dropping {len(self._log_retry)} action log records after {failures} attempts")
+                    self._log_retry, failures = [], 0
+                break
+
+    def _take_logs(self) -> List[tuple]:
+        batch = []
+        while len(batch) < ACTION_LOG_BATCH_SIZE and not self._log_queue.empty():
+            batch.append(self._log_queue.get_nowait())
+        return batch
+
+    async def _write_logs(self, batch: List[tuple]) -> bool:
+        """Запись пачки через COPY, при ошибке - обычным INSERT. False - пачка не записана."""
+        # created_at заполняется по умолчанию в момент записи пачки
+        try:
+            async with self.pool.acquire() as conn:
+                await conn.copy_records_to_table(
+                    'action_logs', records=batch, columns=['user_id', 'action', 'details']
+                )
+            return True
+        except Exception as e:
+            logger.warning(f"COPY of {len(batch)} action log records failed, retrying with INSERT: {e}")
+        try:
+            async with self.pool.acquire() as conn:
+                await conn.executemany(
+                    'INSERT INTO action_logs (user_id, action, details) VALUES ($1, $2, $3)', batch
+                )
+            return True
+        except Exception as e:
+            logger.error(f"Error writing {len(batch)} action log records: {e}")
+            return False
+    
+    async def enqueue_sheet_write(self, range_name: str, values: List[List[str]], value_input_option: str = 'RAW') -> Optional[int]:
+        """Сохранение намерения записи в Google Sheets в outbox"""
         async with self.pool.acquire() as conn:
             try:
-                await conn.execute('''
-                    INSERT INTO action_logs (user_id, action, details) 
-                    VALUES ($1, $2, $3)
-                ''', user_id, action, details)
+                return await conn.fetchval('''
+                    INSERT INTO sheets_outbox (range_name, cell_values, value_input_option) 
+                    VALUES ($1, $2::jsonb, $3) 
+                    RETURNING id
+                ''', range_name, json.dumps(values, ensure_ascii=False), value_input_option)
             except Exception as e:
-                logger.error(f"Error logging action: {e}")
+                logger.error(f"Error enqueueing sheet write for {range_name}: {e}")
+                return None
+    
+    async def get_pending_sheet_writes(self) -> List[Dict]:
+        """Получение неотправленных записей outbox в порядке поступления"""
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch('''
+                SELECT id, range_name, cell_values, value_input_option 
+                FROM sheets_outbox 
+                ORDER BY id
+            ''')
+            return [
+                {**dict(row), 'cell_values': json.loads(row['cell_values'])}
+                for row in rows
+            ]
+    
+    async def delete_sheet_writes(self, ids: List[int]):
+        """Удаление отправленных записей из outbox"""
+        async with self.pool.acquire() as conn:
+            await conn.execute('DELETE FROM sheets_outbox WHERE id = ANY($1::bigint[])', ids)
+    
+    async def get_sheet_rows(self, project_name: str) -> List[Dict]:
+        """Строки задач проекта из зеркала Google Sheets"""
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch('''
+                SELECT row_number, task_name, assignee_name, assignee_phone, note 
+                FROM sheet_rows 
+                WHERE project_name = $1 
+                ORDER BY row_number
+            ''', project_name)
+            return [dict(row) for row in rows]
+    
+    async def get_sheet_projects(self) -> List[str]:
+        """Проекты, строки которых есть в зеркале"""
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch('SELECT DISTINCT project_name FROM sheet_rows ORDER BY project_name')
+            return [row['project_name'] for row in rows]
+    
+    async def sync_sheet_rows(self, project_name: str, rows: List[tuple]) -> int:
+        """Синхронизация зеркала проекта со снимком листа.
+        
+        rows - кортежи (row_number, task_name, assignee_name, assignee_phone, note).
+        Записываются только изменившиеся строки, одним bulk upsert.
+        Возвращает количество изменённых и удалённых строк.
+        """
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                current = {
+                    row['row_number']: tuple(row)[1:]
+                    for row in await conn.fetch('''
+                        SELECT row_number, task_name, assignee_name, assignee_phone, note 
+                        FROM sheet_rows 
+                        WHERE project_name = $1
+                    ''', project_name)
+                }
+                changed = [row for row in rows if current.get(row[0]) != tuple(row[1:])]
+                removed = list(set(current) - {row[0] for row in rows})
+                
+                if changed:
+                    await conn.execute('''
+                        INSERT INTO sheet_rows (project_name, row_number, task_name, assignee_name, assignee_phone, note) 
+                        SELECT $1, * FROM unnest($2::int[], $3::text[], $4::text[], $5::text[], $6::text[]) 
+                        ON CONFLICT (project_name, row_number) DO UPDATE 
+                        SET task_name = EXCLUDED.task_name, 
+                            assignee_name = EXCLUDED.assignee_name, 
+                            assignee_phone = EXCLUDED.assignee_phone, 
+                            note = EXCLUDED.note, 
+                            synced_at = CURRENT_TIMESTAMP
+                    ''', project_name, *[list(column) for column in zip(*changed)])
+                
+                if removed:
+                    await conn.execute(
+                        'DELETE FROM sheet_rows WHERE project_name = $1 AND row_number = ANY($2::int[])',
+                        project_name, removed
+                    )
+                
+                return len(changed) + len(removed)
+    
+    def pool_stats(self) -> Dict:
+        """Состояние пула соединений и число медленных запросов"""
+        if self.pool is None:
+            return {}
+        return {
+            **self.pool.stats(),
+            'slow_queries': DatabaseConnection.slow_queries,
+            'replica': self.replica is not None,
+            'replica_lag': self.replica_lag,
+            'replica_in_use': self._reader() is self.replica,
+        }
     
     async def close(self):
         """Закрытие пула соединений"""
+        if self._maintenance_task:
+            self._maintenance_task.cancel()
+            try:
+                await self._maintenance_task
+            except asyncio.CancelledError:
+                pass
+            self._maintenance_task = None
+        if self._replica_task:
+            self._replica_task.cancel()
+            try:
+                await self._replica_task
+            except asyncio.CancelledError:
+                pass
+            self._replica_task = None
+        if self._activity_task:
+            self._activity_task.cancel()
+            try:
+                await self._activity_task
+            except asyncio.CancelledError:
+                pass
+            self._activity_task = None
+        await self.flush_activity()
+        if self._log_task:
+            self._log_task.cancel()
+            try:
+                await self._log_task
+            except asyncio.CancelledError:
+                pass
+            self._log_task = None
+        if self.pool:
+            while self._log_retry or not self._log_queue.empty():
+                batch, self._log_retry = self._log_retry or self._take_logs(), []
+                if not await self._write_logs(batch):
+                    logger.error(f"Dropping {len(batch) + self._log_queue.qsize()} action log records on shutdown")
+                    break
+        if self._listener_task:
+            self._listener_task.cancel()
+            try:
+                await self._listener_task
+            except asyncio.CancelledError:
+                pass
+            self._listener_task = None
+        if self._listener:
+            listener, self._listener = self._listener, None
+            # asyncpg вызывает termination listener и при штатном close():
+            # без отписки _on_listener_lost переподписался бы во время остановки
+            listener.remove_termination_listener(self._on_listener_lost)
+            await listener.close()
+        if self.replica:
+            replica, self.replica = self.replica, None
+            self.replica_lag = None
+            await replica.close()
         if self.pool:
             await self.pool.close()
             logger.info("Database pool closed")
@@ -1,5 +1,9 @@
 from aiogram import types
-from typing import List
+from typing import TYPE_CHECKING, List, Optional
+
+if TYPE_CHECKING:
+    # Только для аннотаций: sheets тянет gspread, db и глобальные экземпляры
+    from sheets import TaskRow
 
 
 def get_contact_keyboard() -> types.ReplyKeyboardMarkup:
@@ -27,6 +31,7 @@ def get_admin_menu_keyboard() -> types.ReplyKeyboardMarkup:
         types.KeyboardButton(text="📊 Статистика"),
         types.KeyboardButton(text="📑 Все задачи"),
     )
+    keyboard.row(types.KeyboardButton(text="📈 Аналитика"))
     return keyboard
 
 
@@ -40,16 +45,17 @@ def get_projects_keyboard(projects: List[str]) -> types.InlineKeyboardMarkup:
     return markup
 
 
-def get_tasks_keyboard(tasks: List[str], project_name: str) -> types.InlineKeyboardMarkup:
+def get_tasks_keyboard(tasks: List['TaskRow'], project_name: str) -> types.InlineKeyboardMarkup:
     """Инлайн-клавиатура со списком задач для выбранного проекта."""
     markup = types.InlineKeyboardMarkup()
-    for idx, task in enumerate(tasks):
+    for task in tasks:
         # Ограничим длину названия кнопки, чтобы не разъезжалась разметка
-        title = task if len(task) <= 64 else task[:61] + "..."
+        title = task.name if len(task.name) <= 64 else task.name[:61] + "..."
+        # task.index - позиция задачи в полном списке, даже если часть задач скрыта
         markup.add(
             types.InlineKeyboardButton(
                 text=title,
-                callback_data=f"task_{project_name}_{idx}",
+                callback_data=f"task_{project_name}_{task.index}",
             )
         )
     # Кнопка "Назад к проектам"
@@ -59,11 +65,59 @@ def get_tasks_keyboard(tasks: List[str], project_name: str) -> types.InlineKeybo
     return markup
 
 
-def get_admin_keyboard(user_id: int, project_name: str, task_index: int) -> types.InlineKeyboardMarkup:
-    """Инлайн-клавиатура для админа: Одобрить / Отклонить."""
+# Формат created_at курсора в callback-данных (Telegram ограничивает их 64 байтами)
+CURSOR_TIME_FORMAT = '%Y%m%d%H%M%S%f'
+
+# Фильтры статуса списка всех задач: значение в callback-данных -> подпись
+TASK_STATUS_FILTERS = [
+    ('any', 'Все'),
+    ('pending', '⏳'),
+    ('approved', '✅'),
+    ('rejected', '❌'),
+    ('completed', '🎉'),
+    ('cancelled', '🚫'),
+]
+
+
+def get_tasks_page_keyboard(scope: str, status: Optional[str], page: dict,
+                            with_filters: bool = False) -> types.InlineKeyboardMarkup:
+    """Инлайн-клавиатура листания списка задач (scope: my - свои, all - все)."""
+    markup = types.InlineKeyboardMarkup()
+    status_key = status or 'any'
+    items = page['items']
+    buttons = []
+    if items and page['has_prev']:
+        first = items[0]
+        buttons.append(types.InlineKeyboardButton(
+            text="⬅️ Новее",
+            callback_data=f"tpage_{scope}_{status_key}_prev_"
+                          f"{first['created_at'].strftime(CURSOR_TIME_FORMAT)}_{first['id']}",
+        ))
+    if items and page['has_next']:
+        last = items[-1]
+        buttons.append(types.InlineKeyboardButton(
+            text="Старее ➡️",
+            callback_data=f"tpage_{scope}_{status_key}_next_"
+                          f"{last['created_at'].strftime(CURSOR_TIME_FORMAT)}_{last['id']}",
+        ))
+    if buttons:
+        markup.row(*buttons)
+    if with_filters:
+        markup.row(*[
+            types.InlineKeyboardButton(
+                text=f"[{title}]" if key == status_key else title,
+                callback_data=f"tpage_{scope}_{key}_first",
+            )
+            for key, title in TASK_STATUS_FILTERS
+        ])
+    return markup
+
+
+def get_admin_keyboard(task_id: int) -> types.InlineKeyboardMarkup:
+    """Инлайн-клавиатура для админа: Одобрить / Отклонить (по id заявки)."""
     markup = types.InlineKeyboardMarkup()
-    approve_cb = f"approve_{user_id}_{project_name}_{task_index}"
-    reject_cb = f"reject_{user_id}_{project_name}_{task_index}"
+    approve_cb = f"approve_{task_id}"
+    reject_cb = f"reject_{task_id}"
     markup.row(
         types.InlineKeyboardButton(text="✅ Одобрить", callback_data=approve_cb),
         types.InlineKeyboardButton(text="❌ Отклонить", callback_data=reject_cb),
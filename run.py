@@ -6,6 +6,8 @@ import asyncio
 import sys
 from bot import dp, on_startup, on_shutdown
 from aiogram.utils import executor
+from config import BOT_MODE
+from webhook import run_webhook
 from utils.logger import logger
 
 def main():
@@ -15,15 +17,18 @@ def main():
         logger.info("Starting Telegram Task Manager Bot")
         logger.info("=" * 50)
         
-        executor.start_polling(
-            dp,
-            on_startup=on_startup,
-            on_shutdown=on_shutdown,
-            skip_updates=True,
-            timeout=60,
-            relax=0.1,
-            fast=True
-        )
+        if BOT_MODE == 'webhook':
+            run_webhook(dp, on_startup=on_startup, on_shutdown=on_shutdown)
+        else:
+            executor.start_polling(
+                dp,
+                on_startup=on_startup,
+                on_shutdown=on_shutdown,
+                skip_updates=True,
+                timeout=60,
+                relax=0.1,
+                fast=True
+            )
     except KeyboardInterrupt:
         logger.info("Bot stopped by user")
     except Exception as e:
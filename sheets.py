@@ -1,17 +1,268 @@
+import asyncio
+import functools
+import hashlib
+import json
 import os
+import sys
 import gspread_asyncio
 from google.oauth2.service_account import Credentials
-from typing import List, Optional
+from gspread.exceptions import APIError, WorksheetNotFound
+from gspread.utils import absolute_range_name
+from typing import Any, Awaitable, Callable, Dict, List, Optional
 from utils.logger import logger
 from utils.decorators import async_retry
-from utils.cache import cache
-from config import GOOGLE_SHEETS_CREDENTIALS_FILE, GOOGLE_SHEETS_URL, CACHE_TTL
+from utils.cache import cache, acached
+from utils.singleflight import SingleFlight
+from utils.rate_limiter import (
+    sheets_scheduler, READ, WRITE, PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND, PRIORITY_WRITE
+)
+from sheets_writer import sheets_writer
+from db import db
+from config import (
+    GOOGLE_SHEETS_CREDENTIALS_FILE, GOOGLE_SHEETS_URL, GOOGLE_DRIVE_API_URL, CACHE_TTL, CACHE_MAX_STALE
+)
+
+# Диапазон, который читается одним запросом на каждый лист проекта
+SNAPSHOT_RANGE = 'D:K'
+
+# Индексы столбцов внутри строки снимка (D = 0)
+COL_TASK = 0       # D - название задачи
+COL_ASSIGNEE = 1   # E - имя исполнителя
+COL_PHONE = 2      # F - телефон исполнителя
+COL_NOTE = 7       # K - комментарий
+
+# Количество строк заголовка, которые не являются задачами
+HEADER_ROWS = 1
+
+# Приблизительный размер TaskRow без текста ячеек: объект и записи индексов (байт)
+TASK_ROW_SIZE = 400
+
+
+def normalize_task_name(task_name: str) -> str:
+    """Ключ индекса задач: без крайних и повторяющихся пробелов"""
+    return ' '.join(task_name.split())
+
+
+class TaskRow:
+    """Строка задачи листа проекта"""
+
+    __slots__ = ('index', 'row', 'name', 'assignee_name', 'assignee_phone', 'note')
+
+    # Столбец снимка -> поле записи
+    FIELDS = {
+        COL_TASK: 'name',
+        COL_ASSIGNEE: 'assignee_name',
+        COL_PHONE: 'assignee_phone',
+        COL_NOTE: 'note',
+    }
+
+    def __init__(self, index: int, row: int, name: str,
+                 assignee_name: str = '', assignee_phone: str = '', note: str = ''):
+        # index - task_index из callback-данных, row - реальный номер строки листа (с 1)
+        self.index = index
+        self.row = row
+        self.name = name
+        self.assignee_name = assignee_name
+        self.assignee_phone = assignee_phone
+        self.note = note
+
+    @property
+    def assigned(self) -> bool:
+        """Задача уже закреплена за исполнителем"""
+        return bool(self.assignee_name.strip() or self.assignee_phone.strip())
+
+
+class ProjectSnapshot:
+    """Снимок задач листа проекта с реальными номерами строк"""
+
+    def __init__(self, project_name: str, task_rows: List[TaskRow], fingerprint: str,
+                 sheet_id: Optional[int] = None):
+        self.project_name = project_name
+        self.sheet_id = sheet_id
+        # Отпечаток содержимого для обнаружения изменений листа
+        self.fingerprint = fingerprint
+        # Задачи в порядке task_index
+        self.task_rows = task_rows
+        self._by_row = {task.row: task for task in task_rows}
+        # Нормализованное название задачи -> номера строк (строится один раз на загрузку)
+        self.index: Dict[str, List[int]] = {}
+        for task in task_rows:
+            self._index_add(task.name, task.row)
+
+        duplicates = self.duplicates
+        if duplicates:
+            logger.warning(f"Project {project_name} has duplicate task names: {duplicates}")
+
+        # Размер для учёта объёма кэша считается один раз, а не на каждый cache.set
+        self._size = object.__sizeof__(self) + sum(
+            TASK_ROW_SIZE + sys.getsizeof(task.name) + sys.getsizeof(task.assignee_name)
+            + sys.getsizeof(task.assignee_phone) + sys.getsizeof(task.note)
+            for task in task_rows
+        )
+
+    def __sizeof__(self) -> int:
+        # Снимки из файла кэша прежних версий сохранены без _size
+        return getattr(self, '_size', object.__sizeof__(self))
+
+    @classmethod
+    def from_values(cls, project_name: str, values: List[List[str]],
+                    sheet_id: Optional[int] = None) -> 'ProjectSnapshot':
+        """Снимок из ответа values_get по SNAPSHOT_RANGE (values[0] - строка 1 листа)"""
+        task_rows = []
+        for row_number, row in enumerate(values, start=1):
+            if row_number <= HEADER_ROWS or not row or not row[COL_TASK].strip():
+                continue
+            cells = row + [''] * (COL_NOTE + 1 - len(row))
+            task_rows.append(TaskRow(
+                len(task_rows), row_number, cells[COL_TASK].strip(),
+                cells[COL_ASSIGNEE], cells[COL_PHONE], cells[COL_NOTE]
+            ))
+        return cls(project_name, task_rows, cls._fingerprint(task_rows), sheet_id=sheet_id)
+
+    @classmethod
+    def from_mirror(cls, project_name: str, records: List[Dict], sheet_id: Optional[int] = None) -> 'ProjectSnapshot':
+        """Снимок, восстановленный из зеркала sheet_rows"""
+        task_rows = [
+            TaskRow(index, record['row_number'], record['task_name'].strip(),
+                    record['assignee_name'], record['assignee_phone'], record['note'])
+            for index, record in enumerate(records)
+        ]
+        return cls(project_name, task_rows, cls._fingerprint(task_rows), sheet_id=sheet_id)
+
+    @classmethod
+    def _fingerprint(cls, task_rows: List[TaskRow]) -> str:
+        """Отпечаток по строкам задач: одинаков для снимка из Google и из зеркала"""
+        return hashlib.blake2b(
+            json.dumps([list(task) for task in cls._rows_of(task_rows)], ensure_ascii=False).encode('utf-8'),
+            digest_size=16
+        ).hexdigest()
+
+    def _index_add(self, task_name: str, row_number: int):
+        key = normalize_task_name(task_name)
+        if key:
+            self.index.setdefault(key, []).append(row_number)
+
+    def _index_remove(self, task_name: str, row_number: int):
+        key = normalize_task_name(task_name)
+        rows = self.index.get(key)
+        if rows and row_number in rows:
+            rows.remove(row_number)
+            if not rows:
+                del self.index[key]
+
+    @property
+    def duplicates(self) -> Dict[str, List[int]]:
+        """Названия задач, встречающиеся в нескольких строках"""
+        return {key: rows for key, rows in self.index.items() if len(rows) > 1}
+
+    @property
+    def tasks(self) -> List[str]:
+        """Названия задач в порядке task_index"""
+        return [task.name for task in self.task_rows]
+
+    def task_at(self, task_index: int) -> Optional[TaskRow]:
+        """Задача по task_index из callback-данных"""
+        if 0 <= task_index < len(self.task_rows):
+            return self.task_rows[task_index]
+        return None
+
+    def task_in_row(self, row_number: int) -> Optional[TaskRow]:
+        """Задача по реальному номеру строки листа"""
+        return self._by_row.get(row_number)
+
+    def row_for_index(self, task_index: int) -> Optional[int]:
+        """Номер строки листа для task_index из callback-данных"""
+        task = self.task_at(task_index)
+        return task.row if task else None
+
+    def rows_for_name(self, task_name: str) -> List[int]:
+        """Все строки листа с указанным названием задачи"""
+        return list(self.index.get(normalize_task_name(task_name), []))
+
+    def resolve_row(self, task_index: int, task_name: Optional[str] = None) -> Optional[int]:
+        """Строка задачи по task_index с проверкой названия.
+
+        Если по индексу лежит другая задача (лист изменился после показа
+        клавиатуры), строка ищется по названию. Неоднозначное название
+        (дубликаты) не разрешается молча - возвращается None.
+        """
+        task = self.task_at(task_index)
+        if task_name is None:
+            return task.row if task else None
+
+        key = normalize_task_name(task_name)
+        if task and normalize_task_name(task.name) == key:
+            return task.row
+
+        rows = self.index.get(key, [])
+        if len(rows) == 1:
+            return rows[0]
+        if len(rows) > 1:
+            logger.error(
+                f"Task '{task_name}' is ambiguous in project {self.project_name}: rows {rows}"
+            )
+        return None
+
+    @staticmethod
+    def _rows_of(task_rows: List[TaskRow]) -> List[tuple]:
+        return [
+            (task.row, task.name, task.assignee_name, task.assignee_phone, task.note)
+            for task in task_rows
+        ]
+
+    def mirror_rows(self) -> List[tuple]:
+        """Строки задач для зеркала в PostgreSQL: (row, D, E, F, K)"""
+        return self._rows_of(self.task_rows)
+
+    def set_cells(self, row_number: int, col: int, values: List[str]):
+        """Обновление снимка на месте после собственной записи бота"""
+        task = self._by_row.get(row_number)
+        if task is None:
+            return
+        for offset, value in enumerate(values):
+            field = TaskRow.FIELDS.get(col + offset)
+            if field is None:
+                continue
+            if field == 'name':
+                # Индекс по названиям меняется, только если запись задевает столбец D
+                self._index_remove(task.name, row_number)
+                self._index_add(value, row_number)
+            setattr(task, field, value)
+
+
+def _log_refresh_error(cache_key: str, task: asyncio.Future):
+    if not task.cancelled() and task.exception():
+        logger.error(f"Background refresh of {cache_key} failed: {task.exception()}")
+
+
+class SheetsClientManager(gspread_asyncio.AsyncioGspreadClientManager):
+    """Клиент gspread_asyncio, темп вызовов которого задаёт sheets_scheduler"""
+
+    async def delay(self):
+        # Фиксированная пауза между вызовами не нужна: квоты соблюдает планировщик
+        return
+
+    async def handle_gspread_error(self, e, method, args, kwargs):
+        if e.response.status_code == 429:
+            # 429 обрабатывает планировщик с учётом Retry-After
+            raise e
+        await super().handle_gspread_error(e, method, args, kwargs)
+
 
 class GoogleSheetsManager:
     def __init__(self):
         self.agcm = None
         self.spreadsheet = None
         self.cache_ttl = CACHE_TTL
+        # Реестр листов: заполняется из worksheets() и живёт до изменения списка проектов
+        self._worksheets_by_title = {}
+        self._worksheets_by_id = {}
+        # Общие запросы чтения для одновременных промахов кэша
+        self._flights = SingleFlight()
+        # Отпечатки снимков, уже записанных в зеркало sheet_rows
+        self._mirrored: Dict[str, str] = {}
+        # Просмотры списков задач по проектам (сбрасывает прогрев кэша)
+        self.project_views: Dict[str, int] = {}
     
     @async_retry(max_attempts=5)
     async def initialize(self):
@@ -46,9 +297,9 @@ class GoogleSheetsManager:
                 ])
                 return scoped
             
-            self.agcm = gspread_asyncio.AsyncioGspreadClientManager(get_creds)
+            self.agcm = SheetsClientManager(get_creds)
             agc = await self.agcm.authorize()
-            self.spreadsheet = await agc.open_by_url(GOOGLE_SHEETS_URL)
+            self.spreadsheet = await sheets_scheduler.call(READ, agc.open_by_url, GOOGLE_SHEETS_URL)
             
             logger.info("Google Sheets connection initialized successfully")
             
@@ -57,84 +308,297 @@ class GoogleSheetsManager:
             logger.exception("Error initializing Google Sheets")
             raise
     
+    def _register_worksheets(self, worksheets: list) -> bool:
+        """Заполнение реестра листов. Возвращает True, если список проектов изменился."""
+        by_id = {ws.id: ws for ws in worksheets}
+
+        # Названия сравниваются по ключам реестра: объекты листов gspread переиспользует
+        for old_title, old_ws in self._worksheets_by_title.items():
+            new_ws = by_id.get(old_ws.id)
+            if new_ws is None:
+                logger.warning(f"Project sheet '{old_title}' (id {old_ws.id}) was deleted")
+                cache.delete(f"snapshot_{old_title}")
+            elif new_ws.title != old_title:
+                logger.warning(f"Project sheet '{old_title}' (id {old_ws.id}) was renamed to '{new_ws.title}'")
+                cache.delete(f"snapshot_{old_title}")
+
+        changed = [ws.title for ws in worksheets] != list(self._worksheets_by_title)
+        self._worksheets_by_id = by_id
+        self._worksheets_by_title = {ws.title: ws for ws in worksheets}
+        # Реестр прочитан: сбрасываем закэшированные ошибки и отсутствующие листы
+        cache.invalidate_tag("projects")
+        return changed
+
+    async def _refresh_worksheets(self, priority: int = PRIORITY_INTERACTIVE) -> List[str]:
+        """Перечитывание списка листов; одновременные вызовы делят один запрос"""
+        return await self._flights.do("project_names", self._fetch_worksheets, priority)
+
+    async def _fetch_worksheets(self, priority: int) -> List[str]:
+        worksheets = await sheets_scheduler.call(READ, self.spreadsheet.worksheets, priority=priority)
+        if self._register_worksheets(worksheets):
+            logger.info(f"Project list changed: {list(self._worksheets_by_title)}")
+        project_names = list(self._worksheets_by_title)
+        self.cache_put("project_names", project_names)
+        return project_names
+
+    async def refresh_project_names(self, priority: int = PRIORITY_BACKGROUND) -> List[str]:
+        """Перечитывание списка проектов в обход кэша (используется прогревом)"""
+        return await self._refresh_worksheets(priority)
+
+    async def get_worksheet(self, project_name: str, priority: int = PRIORITY_INTERACTIVE):
+        """Лист проекта из реестра; сеть используется только при промахе"""
+        worksheet = self._worksheets_by_title.get(project_name)
+        if worksheet is None:
+            await self._refresh_worksheets(priority)
+            worksheet = self._worksheets_by_title.get(project_name)
+        if worksheet is None:
+            raise WorksheetNotFound(project_name)
+        return worksheet
+
+    def cache_put(self, cache_key: str, value: Any):
+        """Запись в кэш с запасом на отдачу устаревших данных после cache_ttl"""
+        cache.set(cache_key, value, ttl=self.cache_ttl + CACHE_MAX_STALE)
+
+    def _get_fresh_or_stale(self, cache_key: str, refresh: Callable[[], Awaitable],
+                            refresh_key: Optional[str] = None) -> Optional[Any]:
+        """Значение из кэша; устаревшее отдаётся сразу, а обновление уходит в фон.
+        refresh_key - ключ single-flight обновления, если он не совпадает с ключом кэша."""
+        entry = cache.get_entry(cache_key)
+        if entry is None:
+            return None
+        value, age = entry
+        if age < self.cache_ttl and not cache.is_stale(cache_key):
+            return value
+        if age >= self.cache_ttl + CACHE_MAX_STALE:
+            return None
+        if not self._flights.in_flight(refresh_key or cache_key):
+            task = asyncio.ensure_future(refresh())
+            task.add_done_callback(functools.partial(_log_refresh_error, cache_key))
+        return value
+
     @async_retry()
     async def get_project_names(self) -> List[str]:
         """Получение названий проектов (листов) с кэшированием"""
-        cache_key = "project_names"
-        cached = cache.get(cache_key)
+        cached = self._get_fresh_or_stale(
+            "project_names", lambda: self._refresh_worksheets(PRIORITY_BACKGROUND)
+        )
         
-        if cached:
+        if cached is not None:
             return cached
         
         try:
-            worksheets = await self.spreadsheet.worksheets()
-            project_names = [ws.title for ws in worksheets]
-            
-            cache.set(cache_key, project_names)
+            project_names = await self._load_project_names()
             logger.info(f"Found {len(project_names)} projects: {project_names}")
             return project_names
         except Exception as e:
             logger.error(f"Error getting project names: {e}")
-            return []
+            return await self._mirror_project_names()
+
+    @acached("project_names_miss", ttl=0, tags=["projects"])
+    async def _load_project_names(self) -> List[str]:
+        # Удачный список кэширует _fetch_worksheets; здесь на короткое время запоминается ошибка
+        return await self._refresh_worksheets()
     
+    async def get_project_snapshot(self, project_name: str,
+                                   priority: int = PRIORITY_INTERACTIVE) -> ProjectSnapshot:
+        """Снимок столбцов D:K листа проекта (один запрос к API) с кэшированием.
+
+        Попадание в кэш (в том числе устаревшее, с обновлением в фоне) отдаётся
+        сразу; декоратор и single-flight участвуют только в промахе.
+        """
+        cached = self._get_fresh_or_stale(
+            f"snapshot_{project_name}", lambda: self.refresh_project(project_name, PRIORITY_BACKGROUND),
+            refresh_key=f"refresh_{project_name}"
+        )
+
+        if cached is not None:
+            return cached
+
+        return await self._load_project_snapshot(project_name, priority)
+
+    @acached("snapshot_miss:{project_name}", ttl=0, tags=["projects", "project:{project_name}"])
+    async def _load_project_snapshot(self, project_name: str, priority: int) -> ProjectSnapshot:
+        # Удачный снимок кэширует store_snapshot; здесь на короткое время запоминается ошибка,
+        # чтобы отсутствующий лист не запрашивался на каждый клик.
+        # Одновременные промахи по одному проекту ждут один общий запрос
+        return await self._flights.do(f"snapshot_{project_name}", self._load_cold, project_name, priority)
+
+    async def _load_cold(self, project_name: str, priority: int) -> ProjectSnapshot:
+        """Промах кэша: сначала зеркало в PostgreSQL, Google - только если его нет"""
+        snapshot = await self._load_from_mirror(project_name)
+        if snapshot is None:
+            return await self._load_snapshot(project_name, priority)
+
+        self.cache_put(f"snapshot_{project_name}", snapshot)
+        cache.invalidate_tag(f"project:{project_name}")
+        # Зеркало могло отстать от таблицы - сверяемся с Google в фоне
+        task = asyncio.ensure_future(self.refresh_project(project_name, PRIORITY_BACKGROUND))
+        task.add_done_callback(functools.partial(_log_refresh_error, f"snapshot_{project_name}"))
+        return snapshot
+
+    async def refresh_project(self, project_name: str, priority: int = PRIORITY_BACKGROUND) -> ProjectSnapshot:
+        """Перезагрузка снимка проекта из Google в обход кэша (используется прогревом)"""
+        # Свой ключ: совпадающий с холодной загрузкой вызов получил бы снимок из зеркала
+        return await self._flights.do(f"refresh_{project_name}", self._load_snapshot, project_name, priority)
+
+    async def _load_snapshot(self, project_name: str, priority: int) -> ProjectSnapshot:
+        worksheet = await self.get_worksheet(project_name, priority)
+        try:
+            response = await sheets_scheduler.call(
+                READ, self.spreadsheet.values_get,
+                absolute_range_name(project_name, SNAPSHOT_RANGE),
+                priority=priority
+            )
+        except APIError:
+            # Лист мог быть переименован или удалён после заполнения реестра
+            await self._refresh_worksheets(priority)
+            if project_name not in self._worksheets_by_title:
+                raise WorksheetNotFound(project_name)
+            raise
+        snapshot = ProjectSnapshot.from_values(project_name, response.get('values', []), sheet_id=worksheet.id)
+
+        self.store_snapshot(snapshot)
+        logger.info(f"Loaded snapshot of project {project_name}: {len(snapshot.task_rows)} tasks")
+        return snapshot
+
+    def store_snapshot(self, snapshot: ProjectSnapshot):
+        """Сохранение снимка, полученного из Google, в кэш и (в фоне) в зеркало"""
+        self.cache_put(f"snapshot_{snapshot.project_name}", snapshot)
+        cache.invalidate_tag(f"project:{snapshot.project_name}")
+        if db.pool is None or self._mirrored.get(snapshot.project_name) == snapshot.fingerprint:
+            return
+        task = asyncio.ensure_future(self._sync_mirror(snapshot))
+        task.add_done_callback(functools.partial(_log_refresh_error, f"mirror_{snapshot.project_name}"))
+
+    async def _sync_mirror(self, snapshot: ProjectSnapshot):
+        changed = await db.sync_sheet_rows(snapshot.project_name, snapshot.mirror_rows())
+        self._mirrored[snapshot.project_name] = snapshot.fingerprint
+        if changed:
+            logger.info(f"Mirror of project {snapshot.project_name} updated: {changed} rows")
+
+    async def _load_from_mirror(self, project_name: str) -> Optional[ProjectSnapshot]:
+        if db.pool is None:
+            return None
+        try:
+            records = await db.get_sheet_rows(project_name)
+        except Exception as e:
+            logger.error(f"Error reading mirror of project {project_name}: {e}")
+            return None
+        if not records:
+            return None
+        worksheet = self._worksheets_by_title.get(project_name)
+        return ProjectSnapshot.from_mirror(project_name, records, sheet_id=getattr(worksheet, 'id', None))
+
+    async def _mirror_project_names(self) -> List[str]:
+        """Список проектов из зеркала, когда Google недоступен"""
+        if db.pool is None:
+            return []
+        try:
+            project_names = await db.get_sheet_projects()
+        except Exception as e:
+            logger.error(f"Error reading mirrored project names: {e}")
+            return []
+        if project_names:
+            logger.warning(f"Serving {len(project_names)} project names from the database mirror")
+        return project_names
+
+    async def get_spreadsheet_version(self) -> Optional[str]:
+        """Версия файла таблицы из Drive API (меняется при любой правке)"""
+        response = await sheets_scheduler.call(
+            READ, self.agcm._call,
+            self.spreadsheet.ss.client.request, 'get',
+            f"{GOOGLE_DRIVE_API_URL}/{self.spreadsheet.id}",
+            params={'fields': 'version,modifiedTime', 'supportsAllDrives': True},
+            priority=PRIORITY_BACKGROUND
+        )
+        metadata = response.json()
+        return metadata.get('version') or metadata.get('modifiedTime')
+
+    async def fetch_snapshots(self, project_names: List[str],
+                              priority: int = PRIORITY_BACKGROUND) -> Dict[str, ProjectSnapshot]:
+        """Снимки нескольких листов одним values_batch_get, без записи в кэш"""
+        if not project_names:
+            return {}
+        response = await sheets_scheduler.call(
+            READ, self.spreadsheet.values_batch_get,
+            [absolute_range_name(name, SNAPSHOT_RANGE) for name in project_names],
+            priority=priority
+        )
+        # valueRanges возвращаются в порядке запрошенных диапазонов
+        return {
+            name: ProjectSnapshot.from_values(
+                name,
+                value_range.get('values', []),
+                sheet_id=getattr(self._worksheets_by_title.get(name), 'id', None)
+            )
+            for name, value_range in zip(project_names, response.get('valueRanges', []))
+        }
+
     @async_retry()
     async def get_tasks_from_project(self, project_name: str) -> List[str]:
         """Получение задач из столбца D указанного проекта с кэшированием"""
-        cache_key = f"tasks_{project_name}"
-        cached = cache.get(cache_key)
-        
-        if cached:
-            return cached
-        
+        return [task.name for task in await self.get_task_rows(project_name)]
+
+    @async_retry()
+    async def get_task_rows(self, project_name: str, include_assigned: bool = True) -> List[TaskRow]:
+        """Задачи проекта со столбцами D:K; без include_assigned - только свободные"""
+        # Частота просмотров задаёт темп фонового обновления проекта
+        self.project_views[project_name] = self.project_views.get(project_name, 0) + 1
         try:
-            worksheet = await self.spreadsheet.worksheet(project_name)
-            tasks = await worksheet.col_values(4)  # Столбец D = 4
-            
-            if tasks:
-                tasks = [task.strip() for task in tasks[1:] if task.strip()]
-            
-            cache.set(cache_key, tasks)
-            logger.info(f"Found {len(tasks)} tasks in project {project_name}")
-            return tasks
+            snapshot = await self.get_project_snapshot(project_name)
+        except WorksheetNotFound:
+            logger.warning(f"Project {project_name} not found in spreadsheet")
+            return []
         except Exception as e:
             logger.error(f"Error getting tasks from project {project_name}: {e}")
             return []
+        if include_assigned:
+            return list(snapshot.task_rows)
+        return [task for task in snapshot.task_rows if not task.assigned]
     
+    async def _write(self, project_name: str, cells: str, values: List[List[str]],
+                     value_input_option: str = 'RAW') -> bool:
+        """Запись диапазона листа: через outbox, если фоновая запись запущена"""
+        range_name = absolute_range_name(project_name, cells)
+        if sheets_writer.running:
+            return await sheets_writer.submit(range_name, values, value_input_option)
+
+        await sheets_scheduler.call(
+            WRITE, self.spreadsheet.values_update,
+            range_name,
+            params={'valueInputOption': value_input_option},
+            body={'values': values},
+            priority=PRIORITY_WRITE
+        )
+        return True
+
+    async def values_batch_update(self, value_input_option: str, data: List[dict]):
+        """Запись нескольких диапазонов (любых листов) одним запросом"""
+        # gspread_asyncio не оборачивает values_batch_update, вызываем через менеджер клиента
+        await sheets_scheduler.call(
+            WRITE, self.agcm._call,
+            self.spreadsheet.ss.values_batch_update,
+            body={'valueInputOption': value_input_option, 'data': data},
+            priority=PRIORITY_WRITE
+        )
+
     @async_retry()
-    async def assign_task_to_user(self, project_name: str, task_index: int, user_name: str, user_phone: str) -> bool:
+    async def assign_task_to_user(self, project_name: str, task_index: int, user_name: str, user_phone: str,
+                                  task_name: Optional[str] = None) -> bool:
         """Запись данных исполнителя в столбцы E и F"""
         try:
-            worksheet = await self.spreadsheet.worksheet(project_name)
-            # Определяем реальную строку по тексту задачи (столбец D),
+            # Реальная строка берётся из снимка, а не из task_index + 2,
             # чтобы избежать смещений из-за пустых строк/фильтров
-            task_name = await self.get_task_by_index(project_name, task_index)
-            if not task_name:
-                logger.error("assign_task_to_user: task_name not found by index")
-                return False
-            col_d = await worksheet.col_values(4)
-            row_index = None
-            for i, val in enumerate(col_d, start=1):
-                if val.strip() == task_name.strip():
-                    row_index = i
-                    break
+            snapshot = await self.get_project_snapshot(project_name)
+            row_index = snapshot.resolve_row(task_index, task_name)
             if not row_index:
-                logger.error(f"assign_task_to_user: row not found for task '{task_name}'")
+                logger.error(f"assign_task_to_user: task #{task_index} not found in project {project_name}")
                 return False
             
-            # Записываем имя и телефон одновременно
-            await worksheet.batch_update([
-                {
-                    'range': f'E{row_index}',
-                    'values': [[user_name]]
-                },
-                {
-                    'range': f'F{row_index}',
-                    'values': [[user_phone]]
-                }
-            ])
-            
-            # Инвалидируем кэш для этого проекта
-            cache.delete(f"tasks_{project_name}")
+            # Записываем имя и телефон одной записью
+            if not await self._write(project_name, f'E{row_index}:F{row_index}', [[user_name, user_phone]]):
+                return False
+            snapshot.set_cells(row_index, COL_ASSIGNEE, [user_name, user_phone])
             
             logger.info(f"Task assigned to {user_name} in project {project_name}, row {row_index}")
             return True
@@ -144,25 +608,19 @@ class GoogleSheetsManager:
             return False
 
     @async_retry()
-    async def write_note_to_column_k(self, project_name: str, task_index: int, note_text: str) -> bool:
-        """Записывает текст в столбец K (11) строки задачи, найденной по значению в D."""
+    async def write_note_to_column_k(self, project_name: str, task_index: int, note_text: str,
+                                     task_name: Optional[str] = None) -> bool:
+        """Записывает текст в столбец K (11) строки задачи, найденной по снимку листа."""
         try:
-            worksheet = await self.spreadsheet.worksheet(project_name)
-            task_name = await self.get_task_by_index(project_name, task_index)
-            if not task_name:
-                logger.error("write_note_to_column_k: task_name not found by index")
-                return False
-            col_d = await worksheet.col_values(4)
-            row_index = None
-            for i, val in enumerate(col_d, start=1):
-                if val.strip() == task_name.strip():
-                    row_index = i
-                    break
+            snapshot = await self.get_project_snapshot(project_name)
+            row_index = snapshot.resolve_row(task_index, task_name)
             if not row_index:
-                logger.error(f"write_note_to_column_k: row not found for task '{task_name}'")
+                logger.error(f"write_note_to_column_k: task #{task_index} not found in project {project_name}")
                 return False
 
-            await worksheet.update_acell(f'K{row_index}', note_text)
+            if not await self._write(project_name, f'K{row_index}', [[note_text]], 'USER_ENTERED'):
+                return False
+            snapshot.set_cells(row_index, COL_NOTE, [note_text])
             logger.info(f"Note written to column K for project {project_name}, row {row_index}")
             return True
         except Exception as e:
@@ -173,10 +631,9 @@ class GoogleSheetsManager:
     async def get_task_by_index(self, project_name: str, task_index: int) -> Optional[str]:
         """Получение конкретной задачи по индексу"""
         try:
-            tasks = await self.get_tasks_from_project(project_name)
-            if 0 <= task_index < len(tasks):
-                return tasks[task_index]
-            return None
+            snapshot = await self.get_project_snapshot(project_name)
+            task = snapshot.task_at(task_index)
+            return task.name if task else None
         except Exception as e:
             logger.error(f"Error getting task by index: {e}")
             return None
@@ -185,42 +642,36 @@ class GoogleSheetsManager:
     async def get_task_details(self, project_name: str, task_index: int) -> Optional[dict]:
         """Получение полной информации о задаче"""
         try:
-            worksheet = await self.spreadsheet.worksheet(project_name)
-            row_index = task_index + 2
-            
-            # Получаем всю строку
-            row_data = await worksheet.row_values(row_index)
+            snapshot = await self.get_project_snapshot(project_name)
+            task = snapshot.task_at(task_index)
+            if not task:
+                return None
             
-            if len(row_data) >= 6:
-                return {
-                    'task_name': row_data[3] if len(row_data) > 3 else '',
-                    'assignee_name': row_data[4] if len(row_data) > 4 else '',
-                    'assignee_phone': row_data[5] if len(row_data) > 5 else '',
-                }
-            return None
+            return {
+                'task_name': task.name,
+                'assignee_name': task.assignee_name,
+                'assignee_phone': task.assignee_phone,
+                'note': task.note,
+            }
         except Exception as e:
             logger.error(f"Error getting task details: {e}")
             return None
     
     @async_retry()
-    async def clear_task_assignment(self, project_name: str, task_index: int) -> bool:
+    async def clear_task_assignment(self, project_name: str, task_index: int,
+                                    task_name: Optional[str] = None) -> bool:
         """Очистка назначения задачи"""
         try:
-            worksheet = await self.spreadsheet.worksheet(project_name)
-            row_index = task_index + 2
+            snapshot = await self.get_project_snapshot(project_name)
+            row_index = snapshot.resolve_row(task_index, task_name)
+            if not row_index:
+                logger.error(f"clear_task_assignment: task #{task_index} not found in project {project_name}")
+                return False
             
-            await worksheet.batch_update([
-                {
-                    'range': f'E{row_index}',
-                    'values': [['']]
-                },
-                {
-                    'range': f'F{row_index}',
-                    'values': [['']]
-                }
-            ])
+            if not await self._write(project_name, f'E{row_index}:F{row_index}', [['', '']]):
+                return False
+            snapshot.set_cells(row_index, COL_ASSIGNEE, ['', ''])
             
-            cache.delete(f"tasks_{project_name}")
             logger.info(f"Task assignment cleared in project {project_name}, row {row_index}")
             return True
             
@@ -0,0 +1,119 @@
+"""
+Обнаружение изменений в Google Sheets вместо слепого истечения TTL.
+
+Раз в CHANGE_POLL_INTERVAL детектор запрашивает версию файла таблицы
+из Drive API (один дешёвый запрос). Если версия не изменилась, все
+закэшированные снимки подтверждаются как актуальные. Если изменилась -
+список листов перечитывается, а содержимое закэшированных листов
+загружается одним values_batch_get; в кэше заменяются только листы,
+чей отпечаток содержимого отличается. Когда Drive API недоступен,
+отпечатки сравниваются на каждом опросе.
+
+Пока детектор работает, TTL снимков поднимается до CHANGE_DETECTION_TTL.
+Первая проверка выполняется сразу при старте: снимки, восстановленные
+из файла кэша, сверяются с таблицей одним пакетным запросом.
+Источники версии и снимков передаются в конструктор, поэтому детектор
+можно проверять на локальной подделке API.
+"""
+import asyncio
+from typing import Awaitable, Callable, Dict, List, Optional
+from sheets import sheets_manager, ProjectSnapshot
+from utils.cache import cache
+from utils.logger import logger
+from utils.rate_limiter import PRIORITY_BACKGROUND
+from config import CACHE_TTL, CACHE_MAX_STALE, CHANGE_POLL_INTERVAL, CHANGE_DETECTION_TTL
+
+VersionFn = Callable[[], Awaitable[Optional[str]]]
+SnapshotsFn = Callable[[List[str]], Awaitable[Dict[str, ProjectSnapshot]]]
+
+
+class ChangeDetector:
+    """Опрос версии таблицы и точечная инвалидация изменившихся листов"""
+
+    def __init__(self, interval: int = CHANGE_POLL_INTERVAL,
+                 fetch_version: Optional[VersionFn] = None,
+                 fetch_snapshots: Optional[SnapshotsFn] = None):
+        self.interval = interval
+        self._fetch_version = fetch_version or sheets_manager.get_spreadsheet_version
+        self._fetch_snapshots = fetch_snapshots or sheets_manager.fetch_snapshots
+        self._version: Optional[str] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if self.interval <= 0:
+            logger.info("Change detection disabled, cache uses plain TTL")
+            return
+        sheets_manager.cache_ttl = CHANGE_DETECTION_TTL
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"Change detection started, polling every {self.interval}s")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            sheets_manager.cache_ttl = CACHE_TTL
+            logger.info("Change detection stopped")
+
+    async def _run(self):
+        # Первая проверка сразу: она подтверждает снимки, восстановленные из файла
+        while True:
+            try:
+                await self.check()
+            except Exception as e:
+                # Без подтверждения актуальности записи истекут по TTL
+                logger.error(f"Change detection error: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def check(self) -> List[str]:
+        """Один цикл проверки. Возвращает проекты, данные которых обновлены."""
+        try:
+            version = await self._fetch_version()
+        except Exception as e:
+            logger.warning(f"Cannot read spreadsheet version, comparing sheet fingerprints: {e}")
+            version = None
+
+        cached = self._cached_projects()
+        if version is not None and version == self._version:
+            retention = sheets_manager.cache_ttl + CACHE_MAX_STALE
+            cache.touch("project_names", retention)
+            for project_name in cached:
+                cache.touch(f"snapshot_{project_name}", retention)
+            return []
+
+        # Таблица изменилась: переименования и удаления листов видны в реестре
+        if version is not None:
+            await sheets_manager.refresh_project_names(PRIORITY_BACKGROUND)
+            cached = self._cached_projects()
+
+        fresh = await self._fetch_snapshots(list(cached))
+        changed = []
+        for project_name, snapshot in fresh.items():
+            if snapshot.fingerprint != cached[project_name].fingerprint:
+                changed.append(project_name)
+                sheets_manager.store_snapshot(snapshot)
+            else:
+                # Тот же объект сохраняет правки, внесённые ботом на месте
+                cache.touch(f"snapshot_{project_name}", sheets_manager.cache_ttl + CACHE_MAX_STALE)
+
+        self._version = version
+        if changed:
+            logger.info(f"Spreadsheet changed, reloaded projects: {changed}")
+        return changed
+
+    @staticmethod
+    def _cached_projects() -> Dict[str, ProjectSnapshot]:
+        entry = cache.get_entry("project_names")
+        snapshots = {}
+        for project_name in (entry[0] if entry else []):
+            snapshot_entry = cache.get_entry(f"snapshot_{project_name}")
+            if snapshot_entry is not None:
+                snapshots[project_name] = snapshot_entry[0]
+        return snapshots
+
+
+# Глобальный экземпляр детектора изменений
+change_detector = ChangeDetector()
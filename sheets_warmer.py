@@ -0,0 +1,106 @@
+"""
+Прогрев и упреждающее обновление кэша Google Sheets.
+
+При старте загружает задачи всех проектов с ограниченной параллельностью,
+затем обновляет каждый проект незадолго до истечения TTL. Темп обновления
+подстраивается под просмотры: проект, который никто не открывал за цикл,
+обновляется вдвое реже (до 8 раз), а при первом же просмотре
+возвращается к обычному темпу. Пока обновление идёт, пользователи
+получают прежние данные (stale-while-revalidate в sheets.py).
+"""
+import asyncio
+from typing import Dict, Optional
+from sheets import sheets_manager
+from utils.cache import cache
+from utils.logger import logger
+from utils.rate_limiter import PRIORITY_BACKGROUND
+from config import WARMER_CONCURRENCY, WARMER_LEAD
+
+# Период проверки, каким проектам пора обновиться (сек)
+TICK_INTERVAL = 5
+
+# Максимальный множитель интервала обновления для непросматриваемых проектов (2 ** 3)
+MAX_IDLE_CYCLES = 3
+
+
+class CacheWarmer:
+    """Фоновое обновление списка проектов и снимков листов"""
+
+    def __init__(self, concurrency: int = WARMER_CONCURRENCY, lead: int = WARMER_LEAD):
+        self.lead = lead
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._idle_cycles: Dict[str, int] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def refresh_age(self) -> float:
+        """Возраст записи, после которого её пора обновить (TTL меняет детектор изменений)"""
+        return max(sheets_manager.cache_ttl - self.lead, 1)
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+        logger.info("Cache warmer started")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            logger.info("Cache warmer stopped")
+
+    async def warm_all(self):
+        """Загрузка задач всех проектов с ограниченной параллельностью"""
+        projects = await sheets_manager.get_project_names()
+        # Снимки, восстановленные из файла, перепроверяются детектором изменений
+        # или обычным циклом обновления, а не все сразу
+        cold = [name for name in projects if cache.get_entry(f"snapshot_{name}") is None]
+        await asyncio.gather(*(self._refresh(name) for name in cold))
+        logger.info(f"Cache warmed for {len(cold)} of {len(projects)} projects")
+
+    async def _run(self):
+        await self.warm_all()
+        while True:
+            await asyncio.sleep(TICK_INTERVAL)
+            try:
+                await self._refresh_due()
+            except Exception as e:
+                logger.error(f"Cache warmer error: {e}")
+
+    async def _refresh_due(self):
+        entry = cache.get_entry("project_names")
+        if entry is None or entry[1] >= self.refresh_age or cache.is_stale("project_names"):
+            await sheets_manager.refresh_project_names(PRIORITY_BACKGROUND)
+
+        due = []
+        for project_name in await sheets_manager.get_project_names():
+            entry = cache.get_entry(f"snapshot_{project_name}")
+            if entry is None:
+                # Проект ещё не загружался или был сброшен - загрузит первый просмотр
+                continue
+            if cache.is_stale(f"snapshot_{project_name}") or \
+                    entry[1] >= self.refresh_age * 2 ** self._idle_cycles.get(project_name, 0):
+                due.append(project_name)
+
+        if due:
+            await asyncio.gather(*(self._refresh(name) for name in due))
+
+    async def _refresh(self, project_name: str):
+        views = sheets_manager.project_views.pop(project_name, 0)
+        if views:
+            self._idle_cycles[project_name] = 0
+        else:
+            idle = self._idle_cycles.get(project_name, -1) + 1
+            self._idle_cycles[project_name] = min(idle, MAX_IDLE_CYCLES)
+
+        async with self._semaphore:
+            try:
+                await sheets_manager.refresh_project(project_name, PRIORITY_BACKGROUND)
+            except Exception as e:
+                logger.error(f"Error warming project {project_name}: {e}")
+
+
+# Глобальный экземпляр прогрева кэша
+cache_warmer = CacheWarmer()
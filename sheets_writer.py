@@ -0,0 +1,132 @@
+"""
+Фоновая запись в Google Sheets (write-behind).
+
+Обработчики сохраняют намерение записи в outbox PostgreSQL и сразу
+возвращают управление. Фоновая задача раз в SHEETS_FLUSH_INTERVAL
+собирает накопившиеся записи и отправляет их одним values_batch_update
+на всю таблицу. Незавершённые записи переживают перезапуск: outbox
+повторно отправляется при старте.
+"""
+import asyncio
+from typing import Awaitable, Callable, Dict, List, Optional
+from gspread.exceptions import APIError
+from db import db
+from utils.logger import logger
+from config import SHEETS_FLUSH_INTERVAL
+
+# Пауза перед повтором после неудачной отправки пачки
+RETRY_INTERVAL = 5
+
+FlushFn = Callable[[str, List[Dict]], Awaitable[None]]
+
+
+class SheetsWriter:
+    """Очередь записей в Google Sheets с долговременным outbox"""
+
+    def __init__(self, flush_interval: float = SHEETS_FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        self._flush_fn: Optional[FlushFn] = None
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup = asyncio.Event()
+        self._lock = asyncio.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self, flush_fn: FlushFn):
+        """Запуск фоновой отправки; outbox после прошлого запуска дописывает фоновая задача"""
+        self._flush_fn = flush_fn
+        self._task = asyncio.create_task(self._run())
+        # Повторная отправка outbox не должна блокировать запуск бота:
+        # ошибки API обрабатываются в цикле с повтором
+        self._wakeup.set()
+        logger.info("Sheets writer started")
+
+    async def stop(self):
+        """Остановка с финальной отправкой всего накопленного"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            # Неотправленные записи остаются в outbox до следующего запуска
+            logger.error(f"Error flushing sheet writes on shutdown: {e}")
+        logger.info("Sheets writer stopped")
+
+    async def submit(self, range_name: str, values: List[List[str]], value_input_option: str = 'RAW') -> bool:
+        """Сохранение записи в outbox. True - запись не потеряется при сбое."""
+        write_id = await db.enqueue_sheet_write(range_name, values, value_input_option)
+        if write_id is None:
+            return False
+        self._wakeup.set()
+        return True
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            # Окно накопления: записи, пришедшие за интервал, уйдут одной пачкой
+            await asyncio.sleep(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Error flushing sheet writes: {e}")
+                await asyncio.sleep(RETRY_INTERVAL)
+                self._wakeup.set()
+
+    async def flush(self):
+        """Отправка всех записей outbox, сгруппированных по valueInputOption"""
+        if self._flush_fn is None:
+            return
+
+        async with self._lock:
+            pending = await db.get_pending_sheet_writes()
+            if not pending:
+                return
+
+            groups: Dict[str, List[Dict]] = {}
+            for write in pending:
+                groups.setdefault(write['value_input_option'], []).append(write)
+
+            for value_input_option, writes in groups.items():
+                await self._flush_group(value_input_option, writes)
+
+    async def _flush_group(self, value_input_option: str, writes: List[Dict]):
+        # Повторная запись в тот же диапазон перекрывает предыдущую
+        data: Dict[str, List[List[str]]] = {}
+        for write in writes:
+            data[write['range_name']] = write['cell_values']
+        ids = [write['id'] for write in writes]
+
+        try:
+            await self._flush_fn(value_input_option, self._batch(data))
+        except APIError as e:
+            if e.response.status_code != 400:
+                raise
+            # Один неверный диапазон (например, удалённый лист) не должен
+            # блокировать остальные записи: отправляем их по одной
+            logger.warning(f"Batch sheet write rejected, retrying writes one by one: {e}")
+            for range_name, values in data.items():
+                try:
+                    await self._flush_fn(value_input_option, self._batch({range_name: values}))
+                except APIError as single_error:
+                    if single_error.response.status_code != 400:
+                        raise
+                    logger.error(f"Dropping sheet write to {range_name}: {single_error}")
+
+        await db.delete_sheet_writes(ids)
+        logger.info(f"Flushed {len(ids)} sheet writes in {len(data)} ranges ({value_input_option})")
+
+    @staticmethod
+    def _batch(data: Dict[str, List[List[str]]]) -> List[Dict]:
+        return [{'range': range_name, 'values': values} for range_name, values in data.items()]
+
+
+# Глобальный экземпляр фоновой записи
+sheets_writer = SheetsWriter()
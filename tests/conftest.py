@@ -0,0 +1,19 @@
+"""
+Общие настройки тестов: конфигурация обязана быть задана до импорта модулей бота
+"""
+import os
+import sys
+import tempfile
+
+# Корень проекта в пути импорта
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Тестам не нужны настоящие Telegram, PostgreSQL и Google Sheets
+os.environ.setdefault('BOT_TOKEN', '123456:test')
+os.environ.setdefault('POSTGRES_USER', 'test')
+os.environ.setdefault('POSTGRES_PASSWORD', 'test')
+os.environ.setdefault('POSTGRES_DB', 'test')
+os.environ.setdefault('GOOGLE_SHEETS_CREDENTIALS_FILE', 'credentials.json')
+os.environ.setdefault('GOOGLE_SHEETS_URL', 'https://docs.google.com/spreadsheets/d/test')
+os.environ.setdefault('ADMIN_IDS', '1')
+os.environ.setdefault('LOG_FILE', os.path.join(tempfile.gettempdir(), 'bot-tests.log'))
@@ -0,0 +1,149 @@
+"""
+Тесты ChangeDetector на подделке источника версии и снимков
+"""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from sheets import sheets_manager, ProjectSnapshot, SheetsClientManager
+from sheets_changes import ChangeDetector
+from utils.cache import cache
+
+PROJECT = 'Проект'
+VALUES = [['Задача'], ['Задача 1'], ['Задача 2']]
+
+
+class FakeDriveResponse:
+    def __init__(self, metadata: dict):
+        self.metadata = metadata
+
+    def json(self):
+        return self.metadata
+
+
+class FakeDriveClient:
+    """HTTP-клиент gspread, отвечающий метаданными файла из Drive API"""
+
+    def __init__(self, version: str):
+        self.version = version
+        self.requests = []
+
+    def request(self, method, endpoint, params=None):
+        self.requests.append((method, endpoint, params))
+        return FakeDriveResponse({'version': self.version, 'modifiedTime': '2026-01-01T00:00:00Z'})
+
+
+class FakeSheets:
+    """Версия таблицы и снимки листов, которые отдал бы Google"""
+
+    def __init__(self, version: str, values):
+        self.version = version
+        self.values = values
+        self.snapshot_calls = []
+
+    async def fetch_version(self):
+        return self.version
+
+    async def fetch_snapshots(self, project_names):
+        self.snapshot_calls.append(list(project_names))
+        return {name: ProjectSnapshot.from_values(name, self.values) for name in project_names}
+
+
+@pytest.fixture
+def cached_snapshot(monkeypatch):
+    """Закэшированный снимок проекта с истёкшей половиной срока жизни"""
+    cache.clear()
+
+    async def refresh_project_names(priority):
+        return [PROJECT]
+
+    monkeypatch.setattr(sheets_manager, 'refresh_project_names', refresh_project_names)
+    snapshot = ProjectSnapshot.from_values(PROJECT, VALUES)
+    sheets_manager.cache_put('project_names', [PROJECT])
+    sheets_manager.cache_put(f'snapshot_{PROJECT}', snapshot)
+    cache.cache[f'snapshot_{PROJECT}'].stored_at -= 100
+    yield snapshot
+    cache.clear()
+
+
+def _detector(fake: FakeSheets, version: str) -> ChangeDetector:
+    detector = ChangeDetector(fetch_version=fake.fetch_version, fetch_snapshots=fake.fetch_snapshots)
+    # Версия, которую детектор видел на прошлом опросе
+    detector._version = version
+    return detector
+
+
+def test_unchanged_version_only_touches_cache(cached_snapshot):
+    fake = FakeSheets('v1', VALUES)
+
+    changed = asyncio.run(_detector(fake, 'v1').check())
+
+    assert changed == []
+    assert fake.snapshot_calls == []
+    value, age = cache.get_entry(f'snapshot_{PROJECT}')
+    assert value is cached_snapshot
+    assert age < 100
+
+
+def test_changed_version_with_same_fingerprint_keeps_snapshot(cached_snapshot):
+    fake = FakeSheets('v2', [list(row) for row in VALUES])
+    detector = _detector(fake, 'v1')
+
+    changed = asyncio.run(detector.check())
+
+    assert changed == []
+    assert fake.snapshot_calls == [[PROJECT]]
+    value, age = cache.get_entry(f'snapshot_{PROJECT}')
+    assert value is cached_snapshot
+    assert age < 100
+    assert detector._version == 'v2'
+
+
+def test_changed_fingerprint_replaces_snapshot(cached_snapshot):
+    fake = FakeSheets('v2', VALUES + [['Задача 3']])
+
+    changed = asyncio.run(_detector(fake, 'v1').check())
+
+    assert changed == [PROJECT]
+    value, _ = cache.get_entry(f'snapshot_{PROJECT}')
+    assert value is not cached_snapshot
+    assert value.tasks == ['Задача 1', 'Задача 2', 'Задача 3']
+
+
+def test_mirror_and_sheet_snapshots_share_fingerprint():
+    from_sheet = ProjectSnapshot.from_values(PROJECT, VALUES)
+    mirror = [
+        {'row_number': row, 'task_name': name, 'assignee_name': assignee, 'assignee_phone': phone, 'note': note}
+        for row, name, assignee, phone, note in from_sheet.mirror_rows()
+    ]
+
+    assert ProjectSnapshot.from_mirror(PROJECT, mirror).fingerprint == from_sheet.fingerprint
+
+
+def test_version_is_read_through_the_sheets_client(cached_snapshot, monkeypatch):
+    client = FakeDriveClient('v1')
+    spreadsheet = SimpleNamespace(id='sheet-id', ss=SimpleNamespace(client=client))
+    monkeypatch.setattr(sheets_manager, 'spreadsheet', spreadsheet)
+    fake = FakeSheets('unused', VALUES)
+
+    async def run():
+        monkeypatch.setattr(sheets_manager, 'agcm', SheetsClientManager(lambda: None, loop=asyncio.get_running_loop()))
+        # Источник версии по умолчанию - Drive API через клиент gspread и планировщик
+        detector = ChangeDetector(fetch_snapshots=fake.fetch_snapshots)
+        first = await detector.check()
+        second = await detector.check()
+        client.version = 'v2'
+        third = await detector.check()
+        return first, second, third
+
+    first, second, third = asyncio.run(run())
+
+    assert (first, second, third) == ([], [], [])
+    # Неизменная версия не требует чтения листов
+    assert fake.snapshot_calls == [[PROJECT], [PROJECT]]
+    method, endpoint, params = client.requests[0]
+    assert method == 'get'
+    assert endpoint.endswith('/sheet-id')
+    assert params['fields'] == 'version,modifiedTime'
+    assert len(client.requests) == 3
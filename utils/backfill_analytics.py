@@ -0,0 +1,30 @@
+"""
+Утилита для пересборки дневных сводок аналитики из истории задач и журнала действий
+
+Запуск: python utils/backfill_analytics.py
+"""
+import asyncio
+import os
+import sys
+
+# Добавляем родительскую директорию в путь
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import db
+from utils.logger import logger
+
+async def backfill_analytics():
+    """Пересборка task_daily_stats и daily_activity"""
+    try:
+        await db.create_pool()
+        result = await db.backfill_analytics()
+        logger.info(f"✅ Analytics rebuilt: {result['task_days']} project-days, {result['activity_days']} activity days")
+        await db.close()
+        return True
+
+    except Exception as e:
+        logger.error(f"❌ Analytics backfill error: {e}")
+        return False
+
+if __name__ == '__main__':
+    asyncio.run(backfill_analytics())
@@ -1,41 +1,395 @@
+import asyncio
+import hashlib
+import hmac
+import inspect
+import os
+import pickle
+import struct
+import sys
 import time
-from typing import Any, Optional
+import zlib
+from collections import OrderedDict
+from functools import wraps
+from typing import Any, Callable, Dict, Iterable, Optional, Set, Tuple, Union
 from utils.logger import logger
+from utils.singleflight import SingleFlight
+from config import (
+    CACHE_TTL, CACHE_MAX_ENTRIES, CACHE_MAX_BYTES, CACHE_SWEEP_INTERVAL, CACHE_NEGATIVE_TTL,
+    CACHE_PERSIST_INTERVAL, CACHE_PERSIST_KEY, BOT_TOKEN
+)
 
-class SimpleCache:
-    """Простой кэш в памяти с TTL"""
-    
-    def __init__(self, ttl: int = 300):
-        self.cache = {}
+# Признак отсутствия ключа, когда None - допустимое закэшированное значение
+MISSING = object()
+
+# Формат файла снимка: сигнатура, версия формата, длина сжатых данных и их HMAC-SHA256.
+# Подпись проверяется до распаковки: файл, записанный не ботом, не дойдёт до pickle
+PERSIST_MAGIC = b'TGBCACHE'
+PERSIST_VERSION = 2
+PERSIST_HEADER = struct.Struct('>8sHI32s')
+PERSIST_KEY = hashlib.sha256(b'cache-snapshot:' + (CACHE_PERSIST_KEY or BOT_TOKEN).encode('utf-8')).digest()
+
+
+def approximate_size(value: Any) -> int:
+    """Приблизительный размер значения в байтах.
+
+    Считается за O(1) на каждый set: размер контейнера плюс размер его первого
+    элемента, умноженный на число элементов (без обхода вложенных объектов).
+    Крупные значения (ProjectSnapshot) считают свой размер сами один раз при
+    создании и возвращают его через __sizeof__.
+    """
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        if value:
+            key, item = next(iter(value.items()))
+            size += len(value) * (sys.getsizeof(key) + sys.getsizeof(item))
+    elif isinstance(value, (list, tuple)):
+        if value:
+            size += len(value) * sys.getsizeof(value[0])
+    elif isinstance(value, (set, frozenset)):
+        if value:
+            size += len(value) * sys.getsizeof(next(iter(value)))
+    return size
+
+
+class _Entry:
+    __slots__ = ('value', 'stored_at', 'expires_at', 'size', 'tags', 'stale')
+
+    def __init__(self, value: Any, stored_at: float, expires_at: float, size: int,
+                 tags: Tuple[str, ...] = (), stale: bool = False):
+        self.value = value
+        self.stored_at = stored_at
+        self.expires_at = expires_at
+        self.size = size
+        self.tags = tags
+        # Запись восстановлена из файла и ещё не подтверждена источником
+        self.stale = stale
+
+
+class LRUCache:
+    """Кэш в памяти с TTL, ограничением по числу записей и объёму (вытеснение LRU)"""
+
+    def __init__(self, ttl: int = CACHE_TTL, max_entries: int = CACHE_MAX_ENTRIES,
+                 max_bytes: int = CACHE_MAX_BYTES):
+        self.cache: 'OrderedDict[str, _Entry]' = OrderedDict()
         self.ttl = ttl
-    
-    def get(self, key: str) -> Optional[Any]:
-        """Получить значение из кэша"""
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        # Тег -> ключи записей с этим тегом
+        self._tags: Dict[str, Set[str]] = {}
+        self._sweeper: Optional[asyncio.Task] = None
+        self._persister: Optional[asyncio.Task] = None
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """Получить значение из кэша (default - при отсутствии или истечении)"""
+        entry = self.cache.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        if entry.expires_at <= time.time() or entry.stale:
+            # Восстановленные записи отдаёт только stale-while-revalidate (get_entry)
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return default
+        self.cache.move_to_end(key)
+        self.hits += 1
+        return entry.value
+
+    def is_stale(self, key: str) -> bool:
+        """Запись восстановлена из файла и требует перепроверки"""
+        entry = self.cache.get(key)
+        return entry is not None and entry.stale
+
+    def get_entry(self, key: str) -> Optional[Tuple[Any, float]]:
+        """Значение и его возраст в секундах без проверки TTL (для stale-while-revalidate)"""
+        entry = self.cache.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.cache.move_to_end(key)
+        self.hits += 1
+        return entry.value, time.time() - entry.stored_at
+
+    def set(self, key: str, value: Any, ttl: Optional[int] = None, tags: Iterable[str] = ()):
+        """Сохранить значение в кэш (ttl - собственный срок жизни записи)"""
+        now = time.time()
         if key in self.cache:
-            value, timestamp = self.cache[key]
-            if time.time() - timestamp < self.ttl:
-                logger.debug(f"Cache hit for key: {key}")
-                return value
-            else:
-                logger.debug(f"Cache expired for key: {key}")
-                del self.cache[key]
-        return None
-    
-    def set(self, key: str, value: Any):
-        """Сохранить значение в кэш"""
-        self.cache[key] = (value, time.time())
-        logger.debug(f"Cache set for key: {key}")
-    
+            self._remove(key)
+        entry = _Entry(value, now, now + (self.ttl if ttl is None else ttl), approximate_size(value), tuple(tags))
+        self.cache[key] = entry
+        self.total_bytes += entry.size
+        for tag in entry.tags:
+            self._tags.setdefault(tag, set()).add(key)
+        self._evict()
+
+    def touch(self, key: str, ttl: Optional[int] = None) -> bool:
+        """Продлить запись так, будто значение только что сохранено"""
+        entry = self.cache.get(key)
+        if entry is None:
+            return False
+        entry.stored_at = time.time()
+        entry.expires_at = entry.stored_at + (self.ttl if ttl is None else ttl)
+        entry.stale = False
+        self.cache.move_to_end(key)
+        return True
+
     def delete(self, key: str):
         """Удалить значение из кэша"""
         if key in self.cache:
-            del self.cache[key]
-            logger.debug(f"Cache deleted for key: {key}")
-    
+            self._remove(key)
+
+    def invalidate_tag(self, tag: str) -> int:
+        """Удалить все записи с тегом. Возвращает количество удалённых."""
+        keys = self._tags.pop(tag, set())
+        for key in keys:
+            if key in self.cache:
+                self._remove(key)
+        return len(keys)
+
     def clear(self):
         """Очистить весь кэш"""
         self.cache.clear()
+        self._tags.clear()
+        self.total_bytes = 0
         logger.debug("Cache cleared")
 
+    def _remove(self, key: str):
+        self._forget(key, self.cache.pop(key))
+
+    def _forget(self, key: str, entry: _Entry):
+        self.total_bytes -= entry.size
+        for tag in entry.tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def _evict(self):
+        # Самая давно использованная запись - в начале OrderedDict
+        while self.cache and (len(self.cache) > self.max_entries or self.total_bytes > self.max_bytes):
+            key, entry = self.cache.popitem(last=False)
+            self._forget(key, entry)
+            self.evictions += 1
+
+    def sweep(self) -> int:
+        """Удаление всех просроченных записей. Возвращает количество удалённых."""
+        now = time.time()
+        expired = [key for key, entry in self.cache.items() if entry.expires_at <= now]
+        for key in expired:
+            self._remove(key)
+        self.expirations += len(expired)
+        return len(expired)
+
+    def start_sweeper(self, interval: int = CACHE_SWEEP_INTERVAL):
+        """Фоновая очистка просроченных записей"""
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = asyncio.create_task(self._sweep_forever(interval))
+
+    async def stop_sweeper(self):
+        if self._sweeper:
+            self._sweeper.cancel()
+            try:
+                await self._sweeper
+            except asyncio.CancelledError:
+                pass
+            self._sweeper = None
+
+    async def _sweep_forever(self, interval: int):
+        while True:
+            await asyncio.sleep(interval)
+            removed = self.sweep()
+            if removed:
+                logger.debug(f"Cache sweep removed {removed} expired entries")
+
+    def _serialize(self) -> Tuple[bytes, int]:
+        """Сериализация записей (кроме закэшированных ошибок) для файла снимка"""
+        records = [
+            (key, entry.value, entry.stored_at, entry.expires_at, entry.tags)
+            for key, entry in self.cache.items()
+            if not isinstance(entry.value, _Failure)
+        ]
+        try:
+            return pickle.dumps(records, pickle.HIGHEST_PROTOCOL), len(records)
+        except Exception:
+            # Отбрасываем только несериализуемые записи
+            kept = []
+            for record in records:
+                try:
+                    pickle.dumps(record[1], pickle.HIGHEST_PROTOCOL)
+                    kept.append(record)
+                except Exception as e:
+                    logger.debug(f"Cache key {record[0]} is not persisted: {e}")
+            return pickle.dumps(kept, pickle.HIGHEST_PROTOCOL), len(kept)
+
+    async def save(self, path: str) -> int:
+        """Сохранение кэша в файл. Возвращает количество записей."""
+        # Снимок берётся в цикле событий, сжатие и запись - в отдельном потоке
+        payload, count = self._serialize()
+        await asyncio.get_running_loop().run_in_executor(None, _write_snapshot, path, payload)
+        logger.debug(f"Cache persisted: {count} entries to {path}")
+        return count
+
+    def load(self, path: str) -> int:
+        """Загрузка снимка из файла; записи помечаются устаревшими.
+        Возвращает количество восстановленных записей."""
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return 0
+
+        try:
+            magic, version, length, signature = PERSIST_HEADER.unpack_from(data)
+            body = data[PERSIST_HEADER.size:]
+            if magic != PERSIST_MAGIC or version != PERSIST_VERSION:
+                raise ValueError(f"unsupported format {magic!r} v{version}")
+            if len(body) != length or not hmac.compare_digest(signature, _sign(body)):
+                raise ValueError("signature mismatch")
+            records = pickle.loads(zlib.decompress(body))
+        except Exception as e:
+            logger.warning(f"Cache snapshot {path} ignored: {e}")
+            return 0
+
+        now = time.time()
+        restored = 0
+        for key, value, stored_at, expires_at, tags in records:
+            if expires_at <= now or key in self.cache:
+                continue
+            entry = _Entry(value, stored_at, expires_at, approximate_size(value), tags, stale=True)
+            self.cache[key] = entry
+            self.total_bytes += entry.size
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            restored += 1
+        self._evict()
+        logger.info(f"Cache restored from {path}: {restored} entries")
+        return restored
+
+    def start_persistence(self, path: str, interval: int = CACHE_PERSIST_INTERVAL):
+        """Периодическое сохранение кэша в файл"""
+        if self._persister is None or self._persister.done():
+            self._persister = asyncio.create_task(self._persist_forever(path, interval))
+
+    async def stop_persistence(self, path: str):
+        """Остановка периодического сохранения и финальный снимок"""
+        if self._persister:
+            self._persister.cancel()
+            try:
+                await self._persister
+            except asyncio.CancelledError:
+                pass
+            self._persister = None
+        try:
+            await self.save(path)
+        except Exception as e:
+            logger.error(f"Error persisting cache to {path}: {e}")
+
+    async def _persist_forever(self, path: str, interval: int):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.save(path)
+            except Exception as e:
+                logger.error(f"Error persisting cache to {path}: {e}")
+
+    def stats(self) -> Dict[str, int]:
+        """Счётчики попаданий, промахов и вытеснений"""
+        return {
+            'entries': len(self.cache),
+            'bytes': self.total_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
+
+
+def _sign(body: bytes) -> bytes:
+    return hmac.new(PERSIST_KEY, body, hashlib.sha256).digest()
+
+
+def _write_snapshot(path: str, payload: bytes):
+    """Сжатие, подпись и атомарная запись файла снимка (временный файл + rename)"""
+    body = zlib.compress(payload)
+    header = PERSIST_HEADER.pack(PERSIST_MAGIC, PERSIST_VERSION, len(body), _sign(body))
+    tmp_path = f"{path}.tmp"
+    # Файл читает и пишет только владелец процесса бота
+    with open(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'wb') as f:
+        f.write(header)
+        f.write(body)
+    os.replace(tmp_path, path)
+
+
+class _Failure:
+    """Закэшированное исключение (отрицательный результат)"""
+
+    __slots__ = ('error',)
+
+    def __init__(self, error: Exception):
+        self.error = error
+
+
+def is_empty(value: Any) -> bool:
+    """Пустой результат: None или пустая коллекция"""
+    return value is None or (isinstance(value, (list, tuple, dict, set)) and not value)
+
+
+def acached(key: Union[str, Callable[..., str]], ttl: Optional[int] = None,
+            negative_ttl: int = CACHE_NEGATIVE_TTL, tags: Iterable[str] = (),
+            is_negative: Callable[[Any], bool] = is_empty, store: Optional[LRUCache] = None):
+    """Декоратор кэширования результата асинхронной функции.
+
+    key - шаблон с именами аргументов ('user_tasks:{user_id}') или функция
+    от тех же аргументов; tags - шаблоны тегов для invalidate_tag.
+    Пустые результаты и исключения кэшируются на negative_ttl, остальные -
+    на ttl (ttl=0 - кэшировать только отрицательные результаты).
+    Одновременные промахи по одному ключу выполняют функцию один раз.
+    """
+    tag_templates = tuple(tags)
+
+    def decorator(func):
+        signature = inspect.signature(func)
+        flights = SingleFlight()
+
+        async def load(target: LRUCache, cache_key: str, entry_tags: Tuple[str, ...], args, kwargs):
+            try:
+                value = await func(*args, **kwargs)
+            except Exception as e:
+                if negative_ttl > 0:
+                    target.set(cache_key, _Failure(e), negative_ttl, entry_tags)
+                raise
+            if is_negative(value):
+                if negative_ttl > 0:
+                    target.set(cache_key, value, negative_ttl, entry_tags)
+            elif ttl != 0:
+                target.set(cache_key, value, ttl, entry_tags)
+            return value
+
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            cache_key = key(*args, **kwargs) if callable(key) else key.format(**bound.arguments)
+
+            target = store or cache
+            value = target.get(cache_key, MISSING)
+            if value is not MISSING:
+                if isinstance(value, _Failure):
+                    raise value.error
+                return value
+
+            entry_tags = tuple(tag.format(**bound.arguments) for tag in tag_templates)
+            return await flights.do(cache_key, load, target, cache_key, entry_tags, args, kwargs)
+
+        return wrapper
+    return decorator
+
+
 # Глобальный экземпляр кэша
-cache = SimpleCache()
\ No newline at end of file
+cache = LRUCache()
@@ -0,0 +1,82 @@
+"""
+Микробенчмарк кэша: LRUCache против прежнего SimpleCache
+
+Запуск: python utils/cache_benchmark.py
+"""
+import os
+import sys
+import time
+import timeit
+from typing import Any, Optional
+
+# Добавляем родительскую директорию в путь
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.cache import LRUCache
+from utils.logger import logger
+
+KEYS = 1000
+NUMBER = 100000
+
+
+class SimpleCache:
+    """Прежняя реализация кэша (словарь без ограничений) для сравнения"""
+
+    def __init__(self, ttl: int = 300):
+        self.cache = {}
+        self.ttl = ttl
+
+    def get(self, key: str) -> Optional[Any]:
+        if key in self.cache:
+            value, timestamp = self.cache[key]
+            if time.time() - timestamp < self.ttl:
+                logger.debug(f"Cache hit for key: {key}")
+                return value
+            else:
+                logger.debug(f"Cache expired for key: {key}")
+                del self.cache[key]
+        return None
+
+    def set(self, key: str, value: Any):
+        self.cache[key] = (value, time.time())
+        logger.debug(f"Cache set for key: {key}")
+
+
+def _bench(cache, value) -> dict:
+    keys = [f"snapshot_project_{i}" for i in range(KEYS)]
+    for key in keys:
+        cache.set(key, value)
+
+    counter = iter(range(10 ** 9))
+
+    def hit():
+        cache.get(keys[next(counter) % KEYS])
+
+    def miss():
+        cache.get("missing_key")
+
+    def store():
+        cache.set(keys[next(counter) % KEYS], value)
+
+    results = {}
+    for name, fn in (('get hit', hit), ('get miss', miss), ('set', store)):
+        seconds = min(timeit.repeat(fn, number=NUMBER, repeat=3))
+        results[name] = seconds / NUMBER * 1e6
+    return results
+
+
+def run_benchmark():
+    """Сравнение времени get/set (мкс на операцию)"""
+    # Типичное значение: список названий задач одного листа
+    value = [f"Задача {i}" for i in range(50)]
+
+    legacy = _bench(SimpleCache(), value)
+    current = _bench(LRUCache(max_entries=KEYS * 2), value)
+
+    logger.info(f"Cache benchmark, {KEYS} keys, {NUMBER} operations, microseconds per operation")
+    for name in legacy:
+        logger.info(f"{name:>8}: SimpleCache {legacy[name]:.3f}, LRUCache {current[name]:.3f}")
+
+
+if __name__ == '__main__':
+    run_benchmark()
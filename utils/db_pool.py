@@ -0,0 +1,199 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, Optional, Tuple
+import asyncpg
+from utils.logger import logger
+
+# Верхние границы корзин гистограмм (сек); последняя корзина - всё, что дольше
+HISTOGRAM_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class Histogram:
+    """Гистограмма длительностей с фиксированными корзинами"""
+
+    def __init__(self, buckets: Tuple[float, ...] = HISTOGRAM_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float):
+        index = 0
+        while index < len(self.buckets) and seconds > self.buckets[index]:
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q: float) -> float:
+        """Оценка квантиля сверху: граница корзины, в которую он попадает"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            'count': self.count,
+            'avg': self.total / self.count if self.count else 0.0,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'max': self.max,
+        }
+
+
+class _Gate:
+    """Ограничение числа одновременно выданных соединений с изменяемым пределом"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_use = 0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self, timeout: Optional[float] = None):
+        async with self._condition:
+            await asyncio.wait_for(self._condition.wait_for(lambda: self.in_use < self.limit), timeout)
+            self.in_use += 1
+
+    async def release(self):
+        async with self._condition:
+            self.in_use -= 1
+            self._condition.notify()
+
+    async def resize(self, limit: int):
+        async with self._condition:
+            self.limit = limit
+            self._condition.notify_all()
+
+
+class InstrumentedPool:
+    """Обёртка пула asyncpg: время ожидания и удержания соединений, занятые/свободные.
+
+    В адаптивном режиме пул создаётся с max_size соединений, а число одновременно
+    выданных ограничивается пределом между min_size и max_size: предел растёт, когда
+    ожидание соединения превышает target_wait, и снижается, когда часть соединений
+    простаивает. Лишние соединения закрываются пулом по max_inactive_connection_lifetime.
+    """
+
+    def __init__(self, pool: asyncpg.Pool, min_size: int, max_size: int, adaptive: bool = False,
+                 target_wait: float = 0.02, adapt_interval: float = 30.0):
+        self._pool = pool
+        self.min_size = min_size
+        self.max_size = max_size
+        self.target_wait = target_wait
+        self.adapt_interval = adapt_interval
+        self.wait_time = Histogram()
+        self.hold_time = Histogram()
+        self.in_use = 0
+        self.waiting = 0
+        self.failures = 0
+        # Наблюдения за текущий интервал адаптации
+        self._window_wait = Histogram()
+        self._window_peak = 0
+        self._gate: Optional[_Gate] = _Gate(min_size) if adaptive else None
+        self._adapt_task: Optional[asyncio.Task] = None
+        if adaptive:
+            self._adapt_task = asyncio.create_task(self._adapt_forever())
+
+    def __getattr__(self, name):
+        # Остальные методы (get_size, expire_connections, ...) - от исходного пула
+        return getattr(self._pool, name)
+
+    @asynccontextmanager
+    async def acquire(self, timeout: Optional[float] = None):
+        started = time.monotonic()
+        self.waiting += 1
+        try:
+            if self._gate:
+                # Ожидание под пределом входит в тот же таймаут, что и выдача соединения пулом
+                await self._gate.acquire(timeout)
+                if timeout is not None:
+                    timeout = max(0.0, timeout - (time.monotonic() - started))
+            try:
+                conn = await self._pool.acquire(timeout=timeout)
+            except BaseException:
+                if self._gate:
+                    await self._gate.release()
+                raise
+        except Exception:
+            self.failures += 1
+            raise
+        finally:
+            self.waiting -= 1
+
+        acquired = time.monotonic()
+        self.wait_time.observe(acquired - started)
+        self._window_wait.observe(acquired - started)
+        self.in_use += 1
+        self._window_peak = max(self._window_peak, self.in_use)
+        try:
+            yield conn
+        finally:
+            self.in_use -= 1
+            self.hold_time.observe(time.monotonic() - acquired)
+            try:
+                await self._pool.release(conn)
+            finally:
+                if self._gate:
+                    await self._gate.release()
+
+    @property
+    def limit(self) -> int:
+        """Текущий предел одновременно выданных соединений"""
+        return self._gate.limit if self._gate else self.max_size
+
+    async def _adapt_forever(self):
+        while True:
+            await asyncio.sleep(self.adapt_interval)
+            await self.adapt()
+
+    async def adapt(self) -> int:
+        """Пересчёт предела по ожиданию и пиковой занятости за прошедший интервал"""
+        window, peak = self._window_wait, self._window_peak
+        self._window_wait = Histogram()
+        self._window_peak = self.in_use
+        limit = self._gate.limit
+        if window.quantile(0.95) > self.target_wait and limit < self.max_size:
+            # Очередь за соединениями: добавляем четверть, но не меньше одного
+            limit = min(self.max_size, limit + max(1, limit // 4))
+        elif peak < limit - 1 and window.quantile(0.95) <= self.target_wait / 4 and limit > self.min_size:
+            limit = max(self.min_size, limit - 1)
+        if limit != self._gate.limit:
+            logger.info(
+                f"DB pool limit {self._gate.limit} -> {limit} "
+                f"(wait p95 {window.quantile(0.95) * 1000:.1f} ms, peak in use {peak})"
+            )
+            await self._gate.resize(limit)
+        return limit
+
+    def stats(self) -> Dict:
+        """Размер пула, занятые и свободные соединения, время ожидания и удержания"""
+        return {
+            'size': self._pool.get_size(),
+            'idle': self._pool.get_idle_size(),
+            'in_use': self.in_use,
+            'waiting': self.waiting,
+            'limit': self.limit,
+            'failures': self.failures,
+            'wait': self.wait_time.summary(),
+            'hold': self.hold_time.summary(),
+            'wait_buckets': dict(zip(HISTOGRAM_BUCKETS + (float('inf'),), self.wait_time.counts)),
+        }
+
+    async def close(self):
+        if self._adapt_task:
+            self._adapt_task.cancel()
+            try:
+                await self._adapt_task
+            except asyncio.CancelledError:
+                pass
+            self._adapt_task = None
+        await self._pool.close()
@@ -0,0 +1,34 @@
+"""
+Утилита для переноса прежней (несекционированной) таблицы action_logs в секции
+
+При старте бот только переименовывает старую таблицу в action_logs_legacy и
+создаёт секционированную; строки переносятся этой командой короткими
+транзакциями, не блокируя запись журнала.
+
+Запуск: python utils/migrate_action_logs.py [строк в пачке]
+"""
+import asyncio
+import os
+import sys
+
+# Добавляем родительскую директорию в путь
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import db, LOG_MIGRATION_BATCH_SIZE
+from utils.logger import logger
+
+async def migrate_action_logs(batch_size: int = LOG_MIGRATION_BATCH_SIZE):
+    """Перенос action_logs_legacy в секции action_logs"""
+    try:
+        await db.create_pool()
+        moved = await db.migrate_legacy_action_logs(batch_size)
+        logger.info(f"✅ Legacy action logs migrated: {moved} rows")
+        await db.close()
+        return True
+
+    except Exception as e:
+        logger.error(f"❌ Action logs migration error: {e}")
+        return False
+
+if __name__ == '__main__':
+    asyncio.run(migrate_action_logs(int(sys.argv[1]) if len(sys.argv) > 1 else LOG_MIGRATION_BATCH_SIZE))
@@ -0,0 +1,157 @@
+import asyncio
+import heapq
+import itertools
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+from gspread.exceptions import APIError
+from utils.logger import logger
+from config import SHEETS_READ_QUOTA, SHEETS_WRITE_QUOTA, SHEETS_BURST, SHEETS_MAX_THROTTLE_RETRIES
+
+# Классы приоритета: меньше - раньше
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+PRIORITY_WRITE = 2
+
+READ = 'read'
+WRITE = 'write'
+
+
+class TokenBucket:
+    """Token bucket: rate_per_minute токенов в минуту, не больше capacity подряд"""
+
+    def __init__(self, rate_per_minute: int, capacity: int):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def time_until_available(self) -> float:
+        """Сколько секунд ждать до появления целого токена"""
+        self._refill()
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self):
+        self._refill()
+        self.tokens -= 1
+
+    def drain(self):
+        """Обнуление запаса токенов (после ответа 429)"""
+        self._refill()
+        self.tokens = min(self.tokens, 0.0)
+
+
+class _Lane:
+    """Очередь ожидающих вызовов одного вида (чтение/запись) со своим бакетом"""
+
+    def __init__(self, bucket: TokenBucket):
+        self.bucket = bucket
+        self.waiters = []
+        self.dispatcher: Optional[asyncio.Task] = None
+        self.calls = 0
+        self.throttled = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+
+class RequestScheduler:
+    """Планировщик вызовов Google Sheets API с учётом квот.
+
+    Каждый вызов получает токен из бакета своего вида (чтение/запись).
+    Ожидающие вызовы обслуживаются по приоритету, поэтому интерактивное
+    чтение обгоняет фоновые обновления и запись. На 429 планировщик
+    приостанавливает выдачу токенов на Retry-After и повторяет вызов.
+    """
+
+    def __init__(self, read_per_minute: int, write_per_minute: int, burst: int,
+                 max_throttle_retries: int = SHEETS_MAX_THROTTLE_RETRIES):
+        self.max_throttle_retries = max_throttle_retries
+        self._lanes = {
+            READ: _Lane(TokenBucket(read_per_minute, burst)),
+            WRITE: _Lane(TokenBucket(write_per_minute, burst)),
+        }
+        self._seq = itertools.count()
+        self._paused_until = 0.0
+
+    async def acquire(self, kind: str, priority: int = PRIORITY_INTERACTIVE):
+        """Ожидание разрешения на один вызов API"""
+        lane = self._lanes[kind]
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(lane.waiters, (priority, next(self._seq), future))
+        if lane.dispatcher is None or lane.dispatcher.done():
+            lane.dispatcher = asyncio.create_task(self._dispatch(lane))
+
+        started = time.monotonic()
+        await future
+        waited = time.monotonic() - started
+        lane.calls += 1
+        lane.total_wait += waited
+        lane.max_wait = max(lane.max_wait, waited)
+
+    async def _dispatch(self, lane: _Lane):
+        while lane.waiters:
+            delay = max(lane.bucket.time_until_available(), self._paused_until - time.monotonic())
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            _, _, future = heapq.heappop(lane.waiters)
+            if future.done():
+                # Вызывающий код отменил ожидание - токен не тратим
+                continue
+            lane.bucket.consume()
+            future.set_result(None)
+
+    def throttle(self, seconds: float):
+        """Пауза для всех видов вызовов после ответа 429"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        for lane in self._lanes.values():
+            lane.bucket.drain()
+
+    async def call(self, kind: str, fn: Callable[..., Awaitable[Any]], *args,
+                   priority: int = PRIORITY_INTERACTIVE, **kwargs) -> Any:
+        """Выполнение вызова API через очередь с повтором на 429"""
+        attempt = 0
+        while True:
+            await self.acquire(kind, priority)
+            try:
+                return await fn(*args, **kwargs)
+            except APIError as e:
+                if e.response.status_code != 429 or attempt >= self.max_throttle_retries:
+                    raise
+                delay = _retry_after(e) or min(2 ** attempt, 64)
+                attempt += 1
+                self._lanes[kind].throttled += 1
+                logger.warning(f"Sheets quota exceeded in {getattr(fn, '__name__', fn)}, backing off for {delay}s")
+                self.throttle(delay)
+
+    def stats(self) -> Dict[str, Dict]:
+        """Глубина очередей и время ожидания токена по видам вызовов"""
+        return {
+            kind: {
+                'queue_depth': len(lane.waiters),
+                'calls': lane.calls,
+                'throttled': lane.throttled,
+                'avg_wait': lane.total_wait / lane.calls if lane.calls else 0.0,
+                'max_wait': lane.max_wait,
+            }
+            for kind, lane in self._lanes.items()
+        }
+
+
+def _retry_after(error: APIError) -> Optional[float]:
+    """Значение заголовка Retry-After в секундах, если Google его прислал"""
+    value = error.response.headers.get('Retry-After') if error.response is not None else None
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+
+# Глобальный планировщик вызовов Google Sheets API
+sheets_scheduler = RequestScheduler(SHEETS_READ_QUOTA, SHEETS_WRITE_QUOTA, SHEETS_BURST)
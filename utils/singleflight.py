@@ -0,0 +1,32 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict
+
+
+class SingleFlight:
+    """Объединение одновременных запросов с одинаковым ключом.
+
+    Пока запрос по ключу выполняется, остальные вызовы с тем же ключом
+    не запускают свой, а ждут результат первого. Исключение получают
+    все ожидающие. Отмена одного ожидающего не отменяет общий запрос.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Future] = {}
+
+    async def do(self, key: str, fn: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn(*args, **kwargs))
+            self._calls[key] = task
+            task.add_done_callback(lambda done, key=key: self._finish(key, done))
+        return await asyncio.shield(task)
+
+    def in_flight(self, key: str) -> bool:
+        return key in self._calls
+
+    def _finish(self, key: str, task: asyncio.Future):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Исключение помечается полученным, даже если все ожидающие отменены
+        if not task.cancelled():
+            task.exception()
@@ -0,0 +1,135 @@
+"""
+Бенчмарк статистики: прежние восемь запросов против одного агрегатного.
+
+Данные создаются в отдельной схеме (по умолчанию 1 000 000 задач),
+которая удаляется после замера; рабочие таблицы не затрагиваются.
+
+Запуск: python utils/statistics_benchmark.py [количество задач]
+"""
+import asyncio
+import os
+import sys
+import time
+
+# Добавляем родительскую директорию в путь
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import asyncpg
+from config import DATABASE_URL
+from db import STATISTICS_QUERY
+from utils.logger import logger
+
+SCHEMA = 'bench_statistics'
+USERS = 5000
+PROJECTS = 40
+RUNS = 5
+
+# Запросы прежней реализации get_statistics, выполнявшиеся по очереди
+LEGACY_QUERIES = [
+    ('fetchval', 'SELECT COUNT(*) FROM users'),
+    ('fetchval', "SELECT COUNT(*) FROM users WHERE last_activity > CURRENT_TIMESTAMP - INTERVAL '7 days'"),
+    ('fetchval', 'SELECT COUNT(*) FROM tasks'),
+    ('fetchval', "SELECT COUNT(*) FROM tasks WHERE status = 'pending'"),
+    ('fetchval', "SELECT COUNT(*) FROM tasks WHERE status = 'approved'"),
+    ('fetchval', "SELECT COUNT(*) FROM tasks WHERE status = 'rejected'"),
+    ('fetchval', "SELECT COUNT(*) FROM tasks WHERE status = 'completed'"),
+    ('fetch', '''
+        SELECT project_name, COUNT(*) as count
+        FROM tasks
+        GROUP BY project_name
+        ORDER BY count DESC
+        LIMIT 5
+    '''),
+]
+
+
+async def seed(conn: asyncpg.Connection, task_count: int):
+    """Создание схемы с пользователями и задачами (индексы как в db.create_tables)"""
+    await conn.execute(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE')
+    await conn.execute(f'CREATE SCHEMA {SCHEMA}')
+    await conn.execute(f'SET search_path TO {SCHEMA}')
+    await conn.execute('''
+        CREATE TABLE users (
+            user_id BIGINT PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            phone VARCHAR(20) NOT NULL,
+            is_admin BOOLEAN DEFAULT FALSE,
+            is_active BOOLEAN DEFAULT TRUE,
+            registered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    await conn.execute('''
+        CREATE TABLE tasks (
+            id SERIAL PRIMARY KEY,
+            user_id BIGINT REFERENCES users(user_id),
+            project_name VARCHAR(255) NOT NULL,
+            task_name TEXT NOT NULL,
+            task_index INTEGER NOT NULL,
+            status VARCHAR(20) DEFAULT 'pending',
+            admin_id BIGINT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            completed_at TIMESTAMP
+        )
+    ''')
+    await conn.execute('''
+        INSERT INTO users (user_id, name, phone, last_activity)
+        SELECT g, 'User ' || g, '+7900' || lpad(g::text, 7, '0'),
+               CURRENT_TIMESTAMP - random() * INTERVAL '30 days'
+        FROM generate_series(1, $1) g
+    ''', USERS)
+    await conn.execute('''
+        INSERT INTO tasks (user_id, project_name, task_name, task_index, status, created_at)
+        SELECT 1 + (g % $2), 'Project ' || (g % $3), 'Task ' || g, g % 200,
+               (ARRAY['pending', 'approved', 'rejected', 'completed'])[1 + (g % 4)],
+               CURRENT_TIMESTAMP - random() * INTERVAL '365 days'
+        FROM generate_series(1, $1) g
+    ''', task_count, USERS, PROJECTS)
+    await conn.execute('CREATE INDEX ON tasks(user_id, status, created_at DESC, id DESC)')
+    await conn.execute('CREATE INDEX ON tasks(status, created_at DESC, id DESC)')
+    await conn.execute('CREATE INDEX ON tasks(project_name)')
+    await conn.execute('ANALYZE users')
+    await conn.execute('ANALYZE tasks')
+
+
+async def legacy_statistics(conn: asyncpg.Connection):
+    for method, query in LEGACY_QUERIES:
+        await getattr(conn, method)(query)
+
+
+async def single_pass_statistics(conn: asyncpg.Connection):
+    await conn.fetchrow(STATISTICS_QUERY)
+
+
+async def measure(conn: asyncpg.Connection, fn) -> list:
+    # Первый прогон прогревает буферы и не учитывается
+    await fn(conn)
+    timings = []
+    for _ in range(RUNS):
+        started = time.perf_counter()
+        await fn(conn)
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+async def run_benchmark(task_count: int):
+    conn = await asyncpg.connect(DATABASE_URL)
+    try:
+        logger.info(f"Seeding {task_count} tasks into schema {SCHEMA}...")
+        await seed(conn, task_count)
+
+        legacy = await measure(conn, legacy_statistics)
+        single = await measure(conn, single_pass_statistics)
+
+        logger.info(f"Statistics benchmark, {task_count} tasks, {RUNS} runs (ms, min/avg)")
+        logger.info(f"{len(LEGACY_QUERIES)} queries: {min(legacy) * 1000:.1f}/{sum(legacy) / RUNS * 1000:.1f}")
+        logger.info(f"1 query:   {min(single) * 1000:.1f}/{sum(single) / RUNS * 1000:.1f}")
+        logger.info(f"Speedup: {sum(legacy) / sum(single):.2f}x")
+    finally:
+        await conn.execute(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE')
+        await conn.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(run_benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000))
@@ -0,0 +1,196 @@
+"""
+Бенчмарк получения обновлений: long polling (как в run.py) против webhook.
+
+Вместо Telegram Bot API поднимается локальная заглушка: getUpdates отдаёт
+обновления из очереди (long polling), в режиме webhook заглушка сама
+отправляет их POST-запросом на сервер бота. Обработчик отвечает на каждое
+сообщение через sendMessage; задержка - от появления обновления до ответа.
+
+Запуск: python utils/webhook_benchmark.py [количество обновлений]
+"""
+import asyncio
+import os
+import sys
+import time
+
+# Добавляем родительскую директорию в путь
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import aiohttp
+from aiohttp import web
+from aiogram import Bot, Dispatcher, types
+from aiogram.bot.api import TelegramAPIServer
+from utils.logger import logger
+from webhook import WebhookServer, SECRET_HEADER
+
+TOKEN = '123456:BENCHMARK-token'
+API_PORT = 8181
+WEBHOOK_PORT = 8182
+# Всплеск: столько обновлений приходит одновременно
+BURST = 200
+
+
+class FakeBotAPI:
+    """Локальная заглушка Bot API: getUpdates, sendMessage и служебные методы"""
+
+    def __init__(self):
+        self.updates: asyncio.Queue = asyncio.Queue()
+        self.sent_at = {}
+        self.replied = asyncio.Event()
+        self.expected = 0
+        self.session: aiohttp.ClientSession = None
+        self.webhook_url = None
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post('/bot{token}/{method}', self.handle)
+        return app
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        data = await request.post()
+        if method == 'getUpdates':
+            return web.json_response({'ok': True, 'result': await self._get_updates(float(data.get('timeout', 0)))})
+        if method == 'sendMessage':
+            self.sent_at[data['text']] = time.perf_counter()
+            if len(self.sent_at) >= self.expected:
+                self.replied.set()
+            return web.json_response({'ok': True, 'result': {
+                'message_id': len(self.sent_at), 'date': int(time.time()),
+                'chat': {'id': int(data['chat_id']), 'type': 'private'}, 'text': data['text'],
+            }})
+        if method == 'getMe':
+            return web.json_response({'ok': True, 'result': {
+                'id': 123456, 'is_bot': True, 'first_name': 'Benchmark', 'username': 'benchmark_bot',
+            }})
+        # deleteWebhook, setWebhook и прочее
+        return web.json_response({'ok': True, 'result': True})
+
+    async def _get_updates(self, timeout: float) -> list:
+        # Как у Telegram: ответ сразу, как только есть хотя бы одно обновление
+        try:
+            batch = [await asyncio.wait_for(self.updates.get(), timeout or 0.01)]
+        except asyncio.TimeoutError:
+            return []
+        while not self.updates.empty():
+            batch.append(self.updates.get_nowait())
+        return batch
+
+    async def deliver(self, update: dict, secret: str = None):
+        """Доставка обновления: в очередь getUpdates или POST на webhook"""
+        if self.webhook_url is None:
+            await self.updates.put(update)
+            return
+        async with self.session.post(self.webhook_url, json=update, headers={SECRET_HEADER: secret}) as response:
+            if response.status != 200:
+                logger.error(f"Webhook answered {response.status}")
+
+
+def make_update(number: int) -> dict:
+    user = {'id': 1000 + number % 50, 'is_bot': False, 'first_name': 'User'}
+    return {
+        'update_id': number,
+        'message': {
+            'message_id': number, 'date': int(time.time()), 'text': f"ping {number}",
+            'chat': {'id': user['id'], 'type': 'private'}, 'from': user,
+        },
+    }
+
+
+def make_dispatcher() -> Dispatcher:
+    bot = Bot(token=TOKEN, server=TelegramAPIServer.from_base(f"http://127.0.0.1:{API_PORT}"))
+    dp = Dispatcher(bot)
+
+    @dp.message_handler()
+    async def echo(message: types.Message):
+        # Имитация работы обработчика (запрос к БД и т.п.)
+        await asyncio.sleep(0.005)
+        await message.answer(message.text)
+
+    return dp
+
+
+async def measure(api: FakeBotAPI, count: int, secret: str = None) -> dict:
+    """Последовательные обновления (задержка) и всплеск BURST обновлений (пропускная способность)"""
+    latencies = []
+    for number in range(count):
+        api.sent_at.clear()
+        api.expected = 1
+        api.replied.clear()
+        started = time.perf_counter()
+        await api.deliver(make_update(number), secret)
+        await asyncio.wait_for(api.replied.wait(), 10)
+        latencies.append(api.sent_at[f"ping {number}"] - started)
+
+    api.sent_at.clear()
+    api.expected = BURST
+    api.replied.clear()
+    started = time.perf_counter()
+    await asyncio.gather(*[api.deliver(make_update(count + number), secret) for number in range(BURST)])
+    await asyncio.wait_for(api.replied.wait(), 60)
+    burst = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'avg': sum(latencies) / len(latencies) * 1000,
+        'p95': latencies[int(len(latencies) * 0.95) - 1] * 1000,
+        'burst': burst,
+    }
+
+
+async def run_polling(api: FakeBotAPI, count: int) -> dict:
+    dp = make_dispatcher()
+    Bot.set_current(dp.bot)
+    Dispatcher.set_current(dp)
+    api.webhook_url = None
+    # Параметры как в run.py
+    polling = asyncio.create_task(dp.start_polling(timeout=60, relax=0.1, fast=True))
+    try:
+        return await measure(api, count)
+    finally:
+        dp.stop_polling()
+        await polling
+        await (await dp.bot.get_session()).close()
+
+
+async def run_webhook(api: FakeBotAPI, count: int) -> dict:
+    dp = make_dispatcher()
+    server = WebhookServer(dp)
+    runner = web.AppRunner(server.make_app())
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', WEBHOOK_PORT).start()
+    server.start()
+    api.webhook_url = f"http://127.0.0.1:{WEBHOOK_PORT}{server.path}"
+    try:
+        return await measure(api, count, server.secret)
+    finally:
+        await server.stop()
+        await runner.cleanup()
+        await (await dp.bot.get_session()).close()
+
+
+async def run_benchmark(count: int):
+    api = FakeBotAPI()
+    runner = web.AppRunner(api.make_app())
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', API_PORT).start()
+    api.session = aiohttp.ClientSession()
+    try:
+        results = {
+            'polling': await run_polling(api, count),
+            'webhook': await run_webhook(api, count),
+        }
+    finally:
+        await api.session.close()
+        await runner.cleanup()
+
+    logger.info(f"Update delivery benchmark, {count} sequential updates, burst of {BURST}")
+    for mode, result in results.items():
+        logger.info(
+            f"{mode:>7}: latency avg {result['avg']:.1f} ms, p95 {result['p95']:.1f} ms, "
+            f"burst {result['burst'] * 1000:.0f} ms ({BURST / result['burst']:.0f} updates/s)"
+        )
+
+
+if __name__ == '__main__':
+    asyncio.run(run_benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 100))
@@ -0,0 +1,175 @@
+"""
+Бенчмарк записи: прежние запросы (изменение + отдельная запись журнала)
+против подготовленных запросов с журналом в том же операторе.
+
+Данные создаются в отдельной схеме, которая удаляется после замера;
+рабочие таблицы не затрагиваются.
+
+Запуск: python utils/write_benchmark.py [количество заявок]
+"""
+import asyncio
+import os
+import sys
+import time
+
+# Добавляем родительскую директорию в путь
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import asyncpg
+from config import DATABASE_URL
+from db import DatabaseConnection
+from utils.logger import logger
+
+SCHEMA = 'bench_writes'
+USERS = 100
+
+
+async def seed(conn: asyncpg.Connection):
+    """Создание схемы с таблицами и индексами как в db.create_tables"""
+    await conn.execute(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE')
+    await conn.execute(f'CREATE SCHEMA {SCHEMA}')
+    await conn.execute(f'SET search_path TO {SCHEMA}')
+    await conn.execute('''
+        CREATE TABLE users (
+            user_id BIGINT PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            phone VARCHAR(20) NOT NULL,
+            is_admin BOOLEAN DEFAULT FALSE,
+            is_active BOOLEAN DEFAULT TRUE,
+            registered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    await conn.execute('''
+        CREATE TABLE tasks (
+            id SERIAL PRIMARY KEY,
+            user_id BIGINT REFERENCES users(user_id),
+            project_name VARCHAR(255) NOT NULL,
+            task_name TEXT NOT NULL,
+            task_index INTEGER NOT NULL,
+            status VARCHAR(20) DEFAULT 'pending',
+            admin_id BIGINT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            completed_at TIMESTAMP
+        )
+    ''')
+    await conn.execute('''
+        CREATE UNIQUE INDEX ON tasks(user_id, project_name, task_index)
+        WHERE status = 'pending'
+    ''')
+    await conn.execute('''
+        CREATE TABLE action_logs (
+            id BIGSERIAL PRIMARY KEY,
+            user_id BIGINT,
+            action VARCHAR(100) NOT NULL,
+            details TEXT,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    await conn.execute('''
+        INSERT INTO users (user_id, name, phone)
+        SELECT g, 'User ' || g, '+7900' || lpad(g::text, 7, '0')
+        FROM generate_series(1, $1) g
+    ''', USERS)
+
+
+async def log_action(pool: asyncpg.Pool, user_id: int, action: str, details: str):
+    # Прежний log_action: отдельное соединение и отдельный INSERT
+    async with pool.acquire() as conn:
+        await conn.execute('''
+            INSERT INTO action_logs (user_id, action, details)
+            VALUES ($1, $2, $3)
+        ''', user_id, action, details)
+
+
+async def legacy_request(pool: asyncpg.Pool, user_id: int, task_index: int) -> int:
+    """Прежний create_task_request; возвращает число обменов с сервером"""
+    async with pool.acquire() as conn:
+        await conn.fetchval('''
+            INSERT INTO tasks (user_id, project_name, task_name, task_index)
+            VALUES ($1, $2, $3, $4)
+            RETURNING id
+        ''', user_id, 'Project', f'Task {task_index}', task_index)
+    await log_action(pool, user_id, 'task_request', f'Project: Project, Task: Task {task_index}')
+    return 2
+
+
+async def legacy_update(pool: asyncpg.Pool, user_id: int, task_index: int) -> int:
+    """Прежний update_task_status (запрос собирается при каждом вызове)"""
+    status = 'approved'
+    async with pool.acquire() as conn:
+        query = '''
+            UPDATE tasks
+            SET status = $1, updated_at = CURRENT_TIMESTAMP, admin_id = $5
+        '''
+        if status == 'completed':
+            query += ', completed_at = CURRENT_TIMESTAMP'
+        query += ' WHERE user_id = $2 AND project_name = $3 AND task_index = $4'
+        await conn.execute(query, status, user_id, 'Project', task_index, 1)
+    await log_action(pool, user_id, 'task_status_update', f'Status: {status}, Project: Project')
+    return 2
+
+
+async def current_request(pool: asyncpg.Pool, user_id: int, task_index: int) -> int:
+    async with pool.acquire() as conn:
+        row = await conn.fetchrow_statement(
+            'create_task_request', user_id, 'Project', f'Task {task_index}', task_index
+        )
+    return 1 if row else 2
+
+
+async def current_update(pool: asyncpg.Pool, task_id: int) -> int:
+    async with pool.acquire() as conn:
+        await conn.fetchrow_statement('update_task_status', task_id, 'approved', 1, 'pending')
+    return 1
+
+
+async def run_benchmark(requests: int):
+    conn = await asyncpg.connect(DATABASE_URL)
+    pool = None
+    try:
+        await seed(conn)
+        pool = await asyncpg.create_pool(
+            DATABASE_URL,
+            min_size=1,
+            max_size=1,
+            server_settings={'search_path': SCHEMA},
+            connection_class=DatabaseConnection
+        )
+        keys = [(1 + i % USERS, i) for i in range(requests)]
+        results = {}
+
+        started, trips = time.perf_counter(), 0
+        for user_id, task_index in keys:
+            trips += await legacy_request(pool, user_id, task_index)
+            trips += await legacy_update(pool, user_id, task_index)
+        results['legacy'] = (time.perf_counter() - started, trips)
+
+        await conn.execute('TRUNCATE tasks, action_logs RESTART IDENTITY')
+        started, trips = time.perf_counter(), 0
+        for user_id, task_index in keys:
+            trips += await current_request(pool, user_id, task_index)
+        # id заявок идут по порядку после TRUNCATE ... RESTART IDENTITY
+        for task_id in range(1, requests + 1):
+            trips += await current_update(pool, task_id)
+        results['current'] = (time.perf_counter() - started, trips)
+
+        logs = await conn.fetchval('SELECT COUNT(*) FROM action_logs')
+        writes = requests * 2
+        logger.info(f"Write benchmark, {requests} requests + {requests} status updates")
+        for name, (seconds, trips) in results.items():
+            logger.info(
+                f"{name:>7}: {seconds / writes * 1000:.3f} ms per write, "
+                f"{trips / writes:.1f} round trips per write"
+            )
+        logger.info(f"Speedup: {results['legacy'][0] / results['current'][0]:.2f}x, audit rows: {logs}")
+    finally:
+        if pool:
+            await pool.close()
+        await conn.execute(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE')
+        await conn.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(run_benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 5000))
@@ -0,0 +1,146 @@
+"""
+Получение обновлений Telegram через webhook (альтернатива long polling).
+
+aiohttp-сервер проверяет секретный заголовок, кладёт обновление в очередь
+и сразу отвечает 200, не дожидаясь обработчиков. Обработку ведут
+WEBHOOK_CONCURRENCY фоновых задач; при переполнении очереди сервер
+отвечает 503 и Telegram повторяет доставку позже. При старте webhook
+регистрируется в Telegram, при остановке снимается, а принятые
+обновления дообрабатываются.
+"""
+import asyncio
+import hmac
+import secrets
+from typing import Awaitable, Callable, Dict, List, Optional
+from aiohttp import web
+from aiogram import Bot, Dispatcher, types
+from utils.logger import logger
+from config import (
+    WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_HOST, WEBHOOK_PORT,
+    WEBHOOK_CONCURRENCY, WEBHOOK_QUEUE_SIZE, WEBHOOK_MAX_CONNECTIONS
+)
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+# Сколько ждать обработки принятых обновлений при остановке (сек)
+DRAIN_TIMEOUT = 10
+
+Callback = Callable[[Dispatcher], Awaitable[None]]
+
+
+class WebhookServer:
+    """Приём обновлений по webhook с ограниченной параллельностью обработки"""
+
+    def __init__(self, dp: Dispatcher, secret: str = WEBHOOK_SECRET, path: str = WEBHOOK_PATH,
+                 concurrency: int = WEBHOOK_CONCURRENCY, queue_size: int = WEBHOOK_QUEUE_SIZE):
+        self.dp = dp
+        # Секрет задаётся при регистрации webhook, поэтому может меняться от запуска к запуску
+        self.secret = secret or secrets.token_urlsafe(32)
+        self.path = path
+        self.concurrency = concurrency
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._workers: List[asyncio.Task] = []
+        self.received = 0
+        self.rejected = 0
+        self.failed = 0
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        return app
+
+    async def handle(self, request: web.Request) -> web.Response:
+        """Приём обновления: проверка секрета и постановка в очередь"""
+        if not hmac.compare_digest(request.headers.get(SECRET_HEADER, ''), self.secret):
+            logger.warning(f"Webhook request with invalid secret from {request.remote}")
+            return web.Response(status=401)
+        try:
+            update = types.Update(**await request.json())
+        except Exception as e:
+            logger.error(f"Invalid webhook payload: {e}")
+            return web.Response(status=400)
+        try:
+            self._queue.put_nowait(update)
+        except asyncio.QueueFull:
+            # Telegram повторит доставку; так очередь не растёт без предела
+            self.rejected += 1
+            return web.Response(status=503)
+        self.received += 1
+        return web.Response()
+
+    def start(self):
+        """Запуск обработчиков очереди"""
+        for _ in range(self.concurrency):
+            self._workers.append(asyncio.create_task(self._work()))
+        logger.info(f"Webhook workers started: {self.concurrency}")
+
+    async def stop(self):
+        """Дообработка принятых обновлений и остановка обработчиков"""
+        try:
+            await asyncio.wait_for(self._queue.join(), DRAIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning(f"Webhook stopped with {self._queue.qsize()} unprocessed updates")
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def _work(self):
+        Bot.set_current(self.dp.bot)
+        Dispatcher.set_current(self.dp)
+        while True:
+            update = await self._queue.get()
+            try:
+                await self.dp.process_update(update)
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Error processing update {update.update_id}: {e}")
+            finally:
+                self._queue.task_done()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'queue_depth': self._queue.qsize(),
+            'received': self.received,
+            'rejected': self.rejected,
+            'failed': self.failed,
+        }
+
+
+def run_webhook(dp: Dispatcher, on_startup: Optional[Callback] = None, on_shutdown: Optional[Callback] = None):
+    """Запуск бота в режиме webhook (блокирует до остановки процесса)"""
+    server = WebhookServer(dp)
+    app = server.make_app()
+
+    async def startup(_):
+        Bot.set_current(dp.bot)
+        Dispatcher.set_current(dp)
+        if on_startup:
+            await on_startup(dp)
+        server.start()
+        # Как skip_updates в polling: накопившиеся за простой обновления не обрабатываются
+        await dp.bot.set_webhook(
+            f"{WEBHOOK_URL}{server.path}",
+            secret_token=server.secret,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+            drop_pending_updates=True
+        )
+        logger.info(f"Webhook set: {WEBHOOK_URL}{server.path}")
+
+    async def shutdown(_):
+        try:
+            await dp.bot.delete_webhook()
+            logger.info("Webhook deleted")
+        except Exception as e:
+            logger.error(f"Error deleting webhook: {e}")
+        await server.stop()
+        if on_shutdown:
+            await on_shutdown(dp)
+        await dp.storage.close()
+        await dp.storage.wait_closed()
+        session = await dp.bot.get_session()
+        await session.close()
+
+    app.on_startup.append(startup)
+    app.on_shutdown.append(shutdown)
+    web.run_app(app, host=WEBHOOK_HOST, port=WEBHOOK_PORT, print=None)